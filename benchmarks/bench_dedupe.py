@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重复检测过滤的微基准测试
+对比逐对循环实现与向量化的 filter_duplicate_detections，并校验两者结果一致
+
+用法: python benchmarks/bench_dedupe.py [--sizes 10 100 1000] [--repeat 5]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from yolo_inference import YOLOInference  # noqa: E402
+
+
+def reference_filter(inference, new_shapes, existing_shapes, iou_threshold=0.85):
+    """逐对计算IOU的原始实现，作为正确性和性能的基准"""
+    filtered_shapes = []
+    for new_shape in new_shapes:
+        is_duplicate = False
+        new_bbox = inference.points_to_bbox(new_shape["points"])
+        new_label = new_shape["label"]
+        for existing_shape in existing_shapes:
+            if existing_shape["label"] == new_label:
+                existing_bbox = inference.points_to_bbox(existing_shape["points"])
+                iou = inference.calculate_iou(new_bbox, existing_bbox)
+                if iou > iou_threshold:
+                    print(f"Duplicate detection found for {new_label} "
+                          f"(IOU: {iou:.3f} > {iou_threshold}), skipping...")
+                    is_duplicate = True
+                    break
+        if not is_duplicate:
+            filtered_shapes.append(new_shape)
+    return filtered_shapes
+
+
+def make_shapes(rng, count, labels, width=4000, height=3000):
+    """生成随机的矩形标注"""
+    x1 = rng.uniform(0, width - 50, count)
+    y1 = rng.uniform(0, height - 50, count)
+    x2 = x1 + rng.uniform(10, 300, count)
+    y2 = y1 + rng.uniform(10, 300, count)
+    shapes = []
+    for i in range(count):
+        shapes.append({
+            "label": labels[rng.integers(len(labels))],
+            "score": float(rng.uniform(0.25, 1.0)),
+            "points": [[x1[i], y1[i]], [x2[i], y1[i]], [x2[i], y2[i]], [x1[i], y2[i]]],
+        })
+    return shapes
+
+
+def jitter(rng, shapes, scale=2.0):
+    """对已有标注加入少量扰动，模拟对同一图片重复推理"""
+    jittered = []
+    for shape in shapes:
+        dx, dy = rng.normal(0, scale, 2)
+        jittered.append(dict(shape, points=[[x + dx, y + dy] for x, y in shape["points"]]))
+    return jittered
+
+
+def best_time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重复检测过滤微基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="每张图片的检测框数量")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数，取最快一次")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    labels = ["apple", "banana", "orange", "grape"]
+    # 过滤逻辑不依赖模型，跳过模型加载
+    inference = YOLOInference.from_model(None, labels, quiet=True)
+
+    print(f"{'boxes':>8} {'loop (ms)':>12} {'numpy (ms)':>12} {'speedup':>9} {'kept':>6}")
+    for size in args.sizes:
+        existing_shapes = make_shapes(rng, size, labels)
+        # 一半为重复检测，一半为新检测
+        new_shapes = jitter(rng, existing_shapes[:size // 2]) + make_shapes(rng, size - size // 2, labels)
+
+        loop_time, expected = best_time(
+            lambda: reference_filter(inference, new_shapes, existing_shapes), args.repeat)
+        numpy_time, actual = best_time(
+            lambda: inference.filter_duplicate_detections(new_shapes, existing_shapes),
+            args.repeat)
+        if [id(s) for s in expected] != [id(s) for s in actual]:
+            print(f"Mismatch at {size} boxes")
+            return 1
+
+        print(f"{size:>8} {loop_time * 1000:>12.2f} {numpy_time * 1000:>12.2f} "
+              f"{loop_time / numpy_time:>8.1f}x {len(actual):>6}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理流水线基准测试
+在合成的图片目录上完整运行 process_directory，报告吞吐量（图片/秒）、各阶段耗时和峰值内存，
+并可与保存的基线结果对比。
+
+模型可以是固定返回检测框的确定性桩模型（默认，只测流水线本身的开销），
+也可以是真实的YOLOv8权重文件（例如 yolov8n.pt）。
+
+用法:
+    python benchmarks/bench_pipeline.py [--images 200] [--width 1280 --height 720]
+                                        [--model stub|yolov8n.pt] [--repeat 3]
+                                        [--save_baseline base.json | --baseline base.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+
+from yolo_inference import (AnnotatedImage, Detections, StageTimer,  # noqa: E402
+                            YOLOInference, decode_image)
+
+STUB_LABELS = ["apple", "banana", "orange", "grape"]
+
+
+class StubModel:
+    """确定性桩模型：对每张图片返回按图片尺寸缩放的固定检测框，不做任何计算"""
+
+    # 相对坐标 [x1, y1, x2, y2]、置信度、类别
+    BOXES = np.array([[0.10, 0.10, 0.30, 0.40],
+                      [0.50, 0.20, 0.70, 0.60],
+                      [0.15, 0.55, 0.45, 0.90],
+                      [0.60, 0.65, 0.95, 0.95]], dtype=np.float32)
+    SCORES = np.array([0.92, 0.81, 0.55, 0.30], dtype=np.float32)
+    CLASS_IDS = np.array([0, 1, 2, 3], dtype=np.int64)
+
+    def __call__(self, source, conf: float = 0.25, **kwargs):
+        sources = source if isinstance(source, list) else [source]
+        results = []
+        for item in sources:
+            image = decode_image(item) if isinstance(item, str) else item
+            height, width = image.shape[:2]
+            keep = self.SCORES >= conf
+            xyxy = self.BOXES[keep] * np.array([width, height, width, height], np.float32)
+            # 不提供 speed，整个调用的耗时记为 forward
+            results.append(AnnotatedImage(image, Detections(xyxy, self.SCORES[keep],
+                                                            self.CLASS_IDS[keep]), STUB_LABELS))
+        return results
+
+
+class CollectingTimer(StageTimer):
+    """只收集各阶段耗时，不输出报告，由基准测试自行汇总"""
+
+    def __init__(self):
+        super().__init__(output="-", interval=0)
+
+    def emit(self, final: bool = False, **extra):
+        pass
+
+
+def make_dataset(image_dir: str, count: int, width: int, height: int, seed: int = 0):
+    """生成合成图片目录，已存在且数量一致时直接复用"""
+    existing = [name for name in os.listdir(image_dir) if name.endswith(".jpg")] \
+        if os.path.isdir(image_dir) else []
+    if len(existing) == count:
+        return
+    shutil.rmtree(image_dir, ignore_errors=True)
+    os.makedirs(image_dir)
+    rng = np.random.default_rng(seed)
+    # 低分辨率噪声放大，得到接近真实照片压缩率的JPEG
+    for i in range(count):
+        noise = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+        Image.fromarray(noise).resize((width, height), Image.BILINEAR).save(
+            os.path.join(image_dir, f"img_{i:06d}.jpg"), quality=90)
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），平台不支持时返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def run_once(config: dict) -> dict:
+    """在独立的进程中运行一次完整流水线，返回报告"""
+    timer = CollectingTimer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if config["model"] == "stub":
+            # 跳过模型加载，直接装配桩模型
+            inference = YOLOInference.from_model(StubModel(), STUB_LABELS,
+                                                 model_path=config["stub_path"],
+                                                 backend="stub", quiet=True, timer=timer)
+        else:
+            inference = YOLOInference(config["model"], config["labels_file"],
+                                      backend=config["backend"], imgsz=config["imgsz"],
+                                      quiet=True, timer=timer)
+
+        start = time.perf_counter()
+        inference.process_directory(
+            config["image_dir"], config["output_dir"],
+            batch_size=config["batch_size"], prefetch=config["prefetch"],
+            decode_workers=config["decode_workers"], write_workers=config["write_workers"],
+            save_images=config["save_images"], use_cache=config["use_cache"])
+        elapsed = time.perf_counter() - start
+
+    report = timer.report()
+    return {
+        "elapsed_s": elapsed,
+        "images_per_s": config["images"] / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": report["stages"],
+    }
+
+
+def summarize(runs: list) -> dict:
+    """多次运行取吞吐量最高的一次（各阶段耗时取同一次），峰值内存取最大值"""
+    best = max(runs, key=lambda run: run["images_per_s"])
+    rss = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    return {
+        "images_per_s": best["images_per_s"],
+        "elapsed_s": best["elapsed_s"],
+        "peak_rss_mb": max(rss) if rss else None,
+        "stages": best["stages"],
+    }
+
+
+def print_summary(summary: dict, baseline: dict = None):
+    def delta(current, previous):
+        if previous in (None, 0) or current is None:
+            return ""
+        return f"{(current - previous) / previous * 100:+.1f}%"
+
+    base_stages = baseline["stages"] if baseline else {}
+    print(f"{'stage':<12} {'count':>7} {'total (s)':>10} {'mean (ms)':>10} "
+          f"{'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'vs base':>8}")
+    for name, stage in summary["stages"].items():
+        previous = base_stages.get(name, {}).get("mean_ms")
+        print(f"{name:<12} {stage['count']:>7} {stage['total_s']:>10.3f} "
+              f"{stage['mean_ms']:>10.3f} {stage['p50_ms']:>9.3f} {stage['p95_ms']:>9.3f} "
+              f"{stage['p99_ms']:>9.3f} {delta(stage['mean_ms'], previous):>8}")
+
+    line = f"Throughput: {summary['images_per_s']:.1f} images/s"
+    if baseline:
+        line += f" (baseline {baseline['images_per_s']:.1f}, " \
+                f"{delta(summary['images_per_s'], baseline['images_per_s'])})"
+    print(line)
+    if summary["peak_rss_mb"] is not None:
+        line = f"Peak RSS: {summary['peak_rss_mb']:.1f} MB"
+        if baseline and baseline.get("peak_rss_mb"):
+            line += f" (baseline {baseline['peak_rss_mb']:.1f} MB, " \
+                    f"{delta(summary['peak_rss_mb'], baseline['peak_rss_mb'])})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理流水线基准测试")
+    parser.add_argument("--images", type=int, default=200, help="合成图片数量 (默认: 200)")
+    parser.add_argument("--width", type=int, default=1280, help="图片宽度 (默认: 1280)")
+    parser.add_argument("--height", type=int, default=720, help="图片高度 (默认: 720)")
+    parser.add_argument("--model", default="stub",
+                        help="stub 表示确定性桩模型，否则为YOLO权重文件路径 (默认: stub)")
+    parser.add_argument("--labels_file", help="真实模型的标签文件 (使用 --model stub 时不需要)")
+    parser.add_argument("--backend", choices=["ultralytics", "onnxruntime"],
+                        default="ultralytics", help="真实模型的推理后端")
+    parser.add_argument("--imgsz", type=int, default=640, help="onnxruntime 后端的输入尺寸")
+    parser.add_argument("--batch_size", "-b", type=int, default=8, help="批大小 (默认: 8)")
+    parser.add_argument("--prefetch", type=int, default=8, help="预取队列深度 (默认: 8)")
+    parser.add_argument("--decode_workers", type=int, default=2, help="解码线程数 (默认: 2)")
+    parser.add_argument("--write_workers", type=int, default=2, help="写入线程数 (默认: 2)")
+    parser.add_argument("--save_images", action="store_true", help="同时渲染结果图片")
+    parser.add_argument("--resume", action="store_true", help="开启检测结果缓存（计入哈希开销）")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数 (默认: 3)")
+    parser.add_argument("--work_dir", help="合成数据和输出目录 (默认: 系统临时目录)")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--save_baseline", metavar="FILE", help="将本次结果保存为基线")
+    parser.add_argument("--baseline", metavar="FILE", help="与此基线对比")
+    parser.add_argument("--max_regression", type=float, default=0.0,
+                        help="吞吐量比基线下降超过此比例（如0.1）时返回非零，0表示不检查")
+    args = parser.parse_args()
+
+    if args.model != "stub" and not args.labels_file:
+        parser.error("使用真实模型时需要指定 --labels_file")
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "yolo_bench_pipeline")
+    image_dir = os.path.join(work_dir, f"images_{args.images}_{args.width}x{args.height}")
+    print(f"Preparing {args.images} synthetic {args.width}x{args.height} images in {image_dir}")
+    make_dataset(image_dir, args.images, args.width, args.height, args.seed)
+
+    stub_path = os.path.join(work_dir, "stub.model")
+    with open(stub_path, "w") as f:
+        f.write("deterministic stub model\n")
+
+    config = {
+        "model": args.model, "labels_file": args.labels_file, "backend": args.backend,
+        "imgsz": args.imgsz, "stub_path": stub_path, "image_dir": image_dir,
+        "images": args.images, "batch_size": args.batch_size, "prefetch": args.prefetch,
+        "decode_workers": args.decode_workers, "write_workers": args.write_workers,
+        "save_images": args.save_images, "use_cache": args.resume,
+    }
+
+    runs = []
+    # 每次运行使用新的进程和空的输出目录，峰值内存互不影响，缓存也不会跳过图片
+    context = multiprocessing.get_context("spawn")
+    for i in range(args.repeat):
+        output_dir = os.path.join(work_dir, "output")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        with context.Pool(1) as pool:
+            run = pool.apply(run_once, (dict(config, output_dir=output_dir),))
+        runs.append(run)
+        print(f"Run {i + 1}/{args.repeat}: {run['images_per_s']:.1f} images/s")
+
+    summary = summarize(runs)
+    summary["config"] = {key: value for key, value in config.items()
+                         if key not in ("stub_path", "image_dir")}
+    summary["config"].update(width=args.width, height=args.height)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != summary["config"]:
+            print("Warning: baseline was recorded with a different configuration")
+
+    print_summary(summary, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if baseline and args.max_regression > 0:
+        floor = baseline["images_per_s"] * (1 - args.max_regression)
+        if summary["images_per_s"] < floor:
+            print(f"Throughput regressed below {floor:.1f} images/s")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
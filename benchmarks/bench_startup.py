@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行启动耗时基准测试
+基于 python -X importtime 统计各脚本的导入耗时，检查不应在启动时加载的重量级模块，
+并测量 --help 的端到端耗时，用于防止启动速度回退
+
+用法: python benchmarks/bench_startup.py [--repeat 5] [--max_import_ms 300]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 各脚本在导入和 --help 时不应加载的模块
+FORBIDDEN_MODULES = {
+    "yolo_inference": ["torch", "ultralytics", "onnxruntime"],
+    "label_converter": ["numpy", "PIL", "tqdm", "xml.dom.minidom", "xml.etree.ElementTree"],
+}
+
+
+def import_profile(module: str):
+    """用 -X importtime 导入模块，返回 (模块总导入耗时ms, 导入的模块集合)"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+
+    imported = set()
+    total_us = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if not fields[1].isdigit():  # 表头
+            continue
+        name = fields[2]
+        imported.add(name)
+        if name == module:
+            total_us = int(fields[1])
+    return total_us / 1000.0, imported
+
+
+def help_time(script: str, repeat: int) -> float:
+    """测量 `python <script> --help` 的中位耗时 (ms)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, "--help"], cwd=ROOT_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="命令行启动耗时基准测试")
+    parser.add_argument("--repeat", type=int, default=5, help="--help 的重复次数，取中位数")
+    parser.add_argument("--max_import_ms", type=float, default=0,
+                        help="导入耗时上限 (ms)，超过时返回非零退出码，0表示不检查")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<18} {'import (ms)':>12} {'--help (ms)':>12}  forbidden modules loaded")
+    for module, forbidden in FORBIDDEN_MODULES.items():
+        import_ms, imported = import_profile(module)
+        loaded = [name for name in forbidden if name in imported]
+        help_ms = help_time(f"{module}.py", args.repeat)
+        print(f"{module:<18} {import_ms:>12.1f} {help_ms:>12.1f}  {', '.join(loaded) or '-'}")
+
+        if loaded:
+            failed = True
+        if args.max_import_ms and import_ms > args.max_import_ms:
+            print(f"  import time {import_ms:.1f} ms exceeds {args.max_import_ms:.1f} ms")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+将 yolo_inference.py --sink 生成的汇总文件（.jsonl 或 .parquet）
+展开为每张图片一个的X-AnyLabeling标注文件
+
+用法: python expand_detections.py detections.jsonl -o annotations/
+"""
+
+import argparse
+import os
+
+from yolo_inference import expand_detection_sink
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将检测结果汇总文件展开为X-AnyLabeling标注文件")
+    parser.add_argument("sink_path", help="汇总文件路径 (.jsonl 或 .parquet)")
+    parser.add_argument("--output_dir", "-o", required=True, help="标注文件输出目录")
+    parser.add_argument("--iou_threshold", type=float, default=0.85,
+                        help="与已有标注合并时判定重复检测的IOU阈值 (默认: 0.85)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.sink_path):
+        print(f"汇总文件不存在: {args.sink_path}")
+        return 1
+
+    try:
+        record_count, file_count = expand_detection_sink(
+            args.sink_path, args.output_dir, args.iou_threshold)
+    except Exception as e:
+        print(f"处理过程中出错: {str(e)}")
+        return 1
+
+    print(f"Expanded {record_count} records into {file_count} annotation files "
+          f"in {args.output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
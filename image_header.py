@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片尺寸读取
+只解析 JPEG/PNG/BMP/TIFF 文件头获取宽高和EXIF方向，不构造PIL图片；
+结果缓存在尺寸索引中，以图片绝对路径、文件大小和修改时间为键；
+指定索引文件（例如输出目录下的 .image_sizes.idx）后，重复运行时未修改的图片不会再次打开。
+
+只依赖标准库，供 yolo_inference.py 和 label_converter.py 共用。
+"""
+
+import atexit
+import json
+import os
+import struct
+import tempfile
+import threading
+from typing import BinaryIO, Optional, Tuple, Union
+
+# 默认的索引文件名（内容为JSON，不使用 .json 扩展名，避免被当作标注文件）
+INDEX_FILENAME = ".image_sizes.idx"
+
+# 带尺寸信息的JPEG帧起始标记 (SOF0-SOF15，不含 DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                     0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# EXIF Orientation 标签；取值 5-8 表示需要转置，显示时宽高互换
+_ORIENTATION_TAG = 0x0112
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def _read_tiff_orientation(data: bytes) -> int:
+    """从TIFF结构（EXIF数据）的第一个IFD中读取 Orientation，没有时返回1"""
+    if len(data) < 8 or data[:2] not in (b"II", b"MM"):
+        return 1
+    endian = "<" if data[:2] == b"II" else ">"
+    offset = struct.unpack(endian + "I", data[4:8])[0]
+    if offset + 2 > len(data):
+        return 1
+    count = struct.unpack(endian + "H", data[offset:offset + 2])[0]
+    for i in range(count):
+        entry = data[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        if len(entry) < 12:
+            break
+        tag, field_type = struct.unpack(endian + "HH", entry[:4])
+        if tag == _ORIENTATION_TAG and field_type == 3:  # SHORT
+            value = struct.unpack(endian + "H", entry[8:10])[0]
+            return value if 1 <= value <= 8 else 1
+    return 1
+
+
+def _read_jpeg_size(f) -> Optional[Tuple[int, int, int]]:
+    f.seek(2)
+    orientation = None
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":  # 跳过填充字节
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # 没有长度字段的独立标记
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker == 0xE1 and orientation is None:
+            # APP1：与PIL一样只使用第一个EXIF段，EXIF一般位于SOF之前
+            data = f.read(length - 2)
+            if data[:6] == b"Exif\x00\x00":
+                orientation = _read_tiff_orientation(data[6:])
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height, orientation or 1
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _read_png_orientation(f) -> int:
+    """在图像数据之前的 eXIf 块中读取 Orientation，没有时返回1"""
+    f.seek(8)
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return 1
+        length, chunk_type = struct.unpack(">I4s", chunk)
+        if chunk_type == b"eXIf":
+            return _read_tiff_orientation(f.read(length))
+        if chunk_type in (b"IDAT", b"IEND"):
+            return 1
+        f.seek(length + 4, os.SEEK_CUR)  # 数据和CRC
+
+
+def _read_tiff_size(f, header: bytes) -> Optional[Tuple[int, int, int]]:
+    endian = "<" if header[:2] == b"II" else ">"
+    offset = struct.unpack(endian + "I", header[4:8])[0]
+    f.seek(offset)
+    count_bytes = f.read(2)
+    if len(count_bytes) < 2:
+        return None
+    width = height = None
+    orientation = 1
+    for _ in range(struct.unpack(endian + "H", count_bytes)[0]):
+        entry = f.read(12)
+        if len(entry) < 12:
+            return None
+        tag, field_type = struct.unpack(endian + "HH", entry[:4])
+        if tag == _ORIENTATION_TAG and field_type == 3:
+            value = struct.unpack(endian + "H", entry[8:10])[0]
+            orientation = value if 1 <= value <= 8 else 1
+            continue
+        if tag not in (256, 257):
+            continue
+        if field_type == 3:  # SHORT
+            value = struct.unpack(endian + "H", entry[8:10])[0]
+        elif field_type == 4:  # LONG
+            value = struct.unpack(endian + "I", entry[8:12])[0]
+        else:
+            return None
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    if width is None or height is None:
+        return None
+    # PIL 打开TIFF时已经按方向转置（Image.size 即显示尺寸），之后无需再转换
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        return height, width, 1
+    return width, height, 1
+
+
+def _read_header(f: BinaryIO) -> Optional[Tuple[int, int, int]]:
+    """解析文件头，返回 (width, height, EXIF方向)，无法解析时返回None"""
+    header = f.read(32)
+    if header[:2] == b"\xff\xd8":
+        return _read_jpeg_size(f)
+    if header[:8] == b"\x89PNG\r\n\x1a\n" and header[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", header[16:24])
+        return width, height, _read_png_orientation(f)
+    if header[:2] == b"BM" and len(header) >= 26:
+        header_size = struct.unpack("<I", header[14:18])[0]
+        if header_size == 12:  # OS/2 BITMAPCOREHEADER
+            width, height = struct.unpack("<HH", header[18:22])
+            return width, height, 1
+        width, height = struct.unpack("<ii", header[18:26])
+        return width, abs(height), 1  # 高度为负表示自上而下存储
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return _read_tiff_size(f, header)
+    return None
+
+
+def _oriented(width: int, height: int, orientation: int,
+              exif_transpose: bool) -> Tuple[int, int]:
+    if exif_transpose and orientation in _TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def read_image_size(image: Union[str, BinaryIO],
+                    exif_transpose: bool = False) -> Optional[Tuple[int, int]]:
+    """解析文件头获取图片尺寸
+
+    默认与 PIL 的 Image.size 一致（存储尺寸）；exif_transpose 为True时按EXIF方向
+    交换宽高，与 ImageOps.exif_transpose 之后的尺寸一致。
+
+    Args:
+        image: 图片路径或以二进制方式打开的文件对象
+        exif_transpose: 是否按EXIF方向返回显示尺寸
+
+    Returns:
+        (width, height)，格式不支持或文件头无法解析时返回None
+    """
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            result = _read_header(f)
+    else:
+        result = _read_header(image)
+    if result is None:
+        return None
+    return _oriented(*result, exif_transpose)
+
+
+def _read_size_with_pil(image: Union[str, BinaryIO]) -> Tuple[int, int, int]:
+    from PIL import Image
+
+    with Image.open(image) as img:
+        width, height = img.size
+        return width, height, img.getexif().get(_ORIENTATION_TAG, 1)
+
+
+def read_image_size_or_decode(image: Union[str, BinaryIO],
+                              exif_transpose: bool = False) -> Tuple[int, int]:
+    """同 read_image_size，文件头无法解析时用PIL打开图片获取尺寸"""
+    size = read_image_size(image, exif_transpose)
+    if size is not None:
+        return size
+    if not isinstance(image, (str, os.PathLike)):
+        image.seek(0)
+    return _oriented(*_read_size_with_pil(image), exif_transpose)
+
+
+class ImageSizeIndex:
+    """图片尺寸索引，以图片绝对路径为键，保存在调用方指定的索引文件中
+
+    记录格式为 {绝对路径: [文件大小, 修改时间(ns), 宽, 高, EXIF方向]}，宽高为存储尺寸，
+    文件大小或修改时间变化时重新读取。没有指定索引文件或目录不可写时只在内存中缓存，
+    不会向图片目录写入任何文件。
+    """
+
+    def __init__(self, index_path: Optional[str] = None):
+        """初始化并加载已有索引
+
+        Args:
+            index_path: 索引文件路径，为None时只在内存中缓存
+        """
+        self.index_path = index_path
+        self.entries = {}
+        self.dirty = False
+        if index_path is None:
+            return
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, image_path: str, exif_transpose: bool = False) -> Tuple[int, int]:
+        """获取图片尺寸，索引中没有或已过期时读取文件头
+
+        Args:
+            image_path: 图片路径
+            exif_transpose: 是否按EXIF方向返回显示尺寸
+
+        Returns:
+            (width, height)
+        """
+        key = os.path.abspath(image_path)
+        stat = os.stat(image_path)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return _oriented(entry[2], entry[3], entry[4], exif_transpose)
+
+        with open(image_path, "rb") as f:
+            result = _read_header(f)
+        if result is None:
+            result = _read_size_with_pil(image_path)
+        width, height, orientation = int(result[0]), int(result[1]), int(result[2])
+        self.entries[key] = [stat.st_size, stat.st_mtime_ns, width, height, orientation]
+        self.dirty = True
+        return _oriented(width, height, orientation, exif_transpose)
+
+    def save(self):
+        """有新记录时原子地写回索引文件，没有索引文件或目录不可写时忽略"""
+        if not self.dirty or self.index_path is None:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".idx.tmp",
+                                            dir=os.path.dirname(os.path.abspath(self.index_path)))
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp_path, self.index_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        except OSError:
+            return
+        self.dirty = False
+
+
+_index: Optional[ImageSizeIndex] = None
+_lock = threading.Lock()
+
+
+def set_index_path(index_path: Optional[str]):
+    """指定尺寸索引文件的位置（例如输出目录下的 .image_sizes.idx）
+
+    之前读取的尺寸先写回原来的索引文件。没有调用时只在内存中缓存。
+
+    Args:
+        index_path: 索引文件路径，为None时只在内存中缓存
+    """
+    global _index
+    with _lock:
+        if _index is not None:
+            if _index.index_path == index_path:
+                return
+            _index.save()
+        else:
+            atexit.register(save_index)
+        _index = ImageSizeIndex(index_path)
+
+
+def get_image_size(image_path: str, exif_transpose: bool = False) -> Tuple[int, int]:
+    """通过尺寸索引获取图片尺寸
+
+    Args:
+        image_path: 图片路径
+        exif_transpose: 是否按EXIF方向返回显示尺寸（与解码时应用 exif_transpose 一致）
+
+    Returns:
+        (width, height)
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            atexit.register(save_index)
+            _index = ImageSizeIndex()
+        return _index.get(image_path, exif_transpose)
+
+
+def save_index():
+    """把新读取的尺寸写回索引文件（进程退出时也会自动调用）"""
+    with _lock:
+        if _index is not None:
+            _index.save()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+YOLOv8本地推理服务
+模型只加载一次，通过本机HTTP接口接收图片，将并发请求动态合并为小批次推理，
+返回X-AnyLabeling格式的标注JSON
+
+启动服务:   python inference_server.py serve model.pt labels.txt [--port 8765]
+本地客户端: python inference_server.py client image1.jpg image2.jpg ... [--concurrency 8]
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from yolo_inference import YOLOInference
+
+
+class MicroBatcher:
+    """将并发到达的请求合并为小批次，在单独的线程中推理
+
+    第一个请求到达后最多再等待 max_wait_ms 毫秒收集更多请求，
+    批次达到 max_batch_size 时立即推理。
+    """
+
+    def __init__(self, inference: YOLOInference, max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0, latency_window: int = 1000):
+        """初始化
+
+        Args:
+            inference: 推理器
+            max_batch_size: 每批最多合并的请求数
+            max_wait_ms: 收集批次的最长等待时间（毫秒）
+            latency_window: 统计延迟分位数时保留的最近请求数
+        """
+        self.inference = inference
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=latency_window)
+        self.request_count = 0
+        self.batch_count = 0
+        self.error_count = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, image: np.ndarray, conf_threshold: float) -> Future:
+        """提交一张图片
+
+        Args:
+            image: HxWx3 的 BGR 数组
+            conf_threshold: 置信度阈值
+
+        Returns:
+            结果为 Detections 的 Future
+        """
+        future = Future()
+        self.requests.put((image, conf_threshold, future, time.perf_counter()))
+        return future
+
+    def _collect(self) -> list:
+        """阻塞等待第一个请求，然后在等待时间内尽量凑满一个批次"""
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [item for item in batch if item is not None]
+
+    def _run(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+            images = [image for image, _, _, _ in batch]
+            # 以批次中最低的阈值推理一次，再按各请求自己的阈值过滤
+            min_conf = min(conf for _, conf, _, _ in batch)
+            try:
+                batch_detections, _ = self.inference.detect_batch(
+                    [f"request{i}" for i in range(len(batch))], min_conf, images=images)
+            except Exception as e:
+                with self.lock:
+                    self.error_count += len(batch)
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            with self.lock:
+                self.batch_count += 1
+                self.request_count += len(batch)
+                for _, _, _, submitted in batch:
+                    self.latencies.append(finished - submitted)
+            for (_, conf, future, _), detections in zip(batch, batch_detections):
+                if conf > min_conf:
+                    detections = detections.select(detections.scores > conf)
+                future.set_result(detections)
+
+    def stats(self) -> dict:
+        """返回队列深度、批次统计和延迟分位数"""
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64) * 1000.0
+            stats = {
+                "queue_depth": self.requests.qsize(),
+                "requests": self.request_count,
+                "batches": self.batch_count,
+                "errors": self.error_count,
+                "mean_batch_size": (self.request_count / self.batch_count
+                                    if self.batch_count else 0.0),
+            }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats["latency_ms"] = {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        else:
+            stats["latency_ms"] = {"p50": None, "p95": None, "p99": None}
+        return stats
+
+    def close(self):
+        """停止批处理线程"""
+        self.running = False
+        self.requests.put(None)
+        self.thread.join(timeout=5)
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP接口
+
+    POST /predict?conf=0.25&name=image.jpg  请求体为图片文件内容，返回标注JSON
+    GET  /stats                             返回队列深度和延迟分位数
+    GET  /health                            健康检查
+    """
+
+    server_version = "YOLOInferenceServer/1.0"
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == "/stats":
+            self._send_json(200, self.server.batcher.stats())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path: {path}"})
+
+    def do_POST(self):
+        parsed = urllib.parse.urlparse(self.path)
+        if parsed.path != "/predict":
+            self._send_json(404, {"error": f"Unknown path: {parsed.path}"})
+            return
+
+        params = urllib.parse.parse_qs(parsed.query)
+        try:
+            conf_threshold = float(params.get("conf", [self.server.conf_threshold])[0])
+            name = params.get("name", ["image.jpg"])[0]
+            length = int(self.headers.get("Content-Length", 0))
+            if length <= 0:
+                raise ValueError("Empty request body")
+            with Image.open(io.BytesIO(self.rfile.read(length))) as img:
+                img = ImageOps.exif_transpose(img).convert("RGB")
+                image = np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            detections = self.server.batcher.submit(image, conf_threshold).result(
+                timeout=self.server.request_timeout)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        inference = self.server.batcher.inference
+        annotation = inference.create_annotation_template(
+            name, image_size=(image.shape[1], image.shape[0]))
+        annotation["shapes"] = detections.to_shapes(inference.labels)
+        self._send_json(200, annotation)
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def serve(args) -> int:
+    """加载模型并启动服务"""
+    for path, desc in ((args.model_path, "模型文件"), (args.labels_file, "标签文件")):
+        if not os.path.exists(path):
+            print(f"{desc}不存在: {path}")
+            return 1
+
+    inference = YOLOInference(args.model_path, args.labels_file,
+                              backend=args.backend, imgsz=args.imgsz)
+    batcher = MicroBatcher(inference, args.max_batch_size, args.max_wait_ms)
+
+    server = ThreadingHTTPServer((args.host, args.port), InferenceRequestHandler)
+    server.batcher = batcher
+    server.conf_threshold = args.conf
+    server.request_timeout = args.request_timeout
+    server.quiet = args.quiet
+    print(f"Serving on http://{args.host}:{args.port} "
+          f"(max batch size {args.max_batch_size}, max wait {args.max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+    return 0
+
+
+def predict_file(url: str, image_path: str, conf_threshold: Optional[float] = None) -> dict:
+    """将一张图片发送给推理服务，返回标注JSON
+
+    Args:
+        url: 服务地址，例如 http://127.0.0.1:8765
+        image_path: 图片路径
+        conf_threshold: 置信度阈值，为None时使用服务端默认值
+
+    Returns:
+        X-AnyLabeling 格式的标注字典
+    """
+    params = {"name": os.path.basename(image_path)}
+    if conf_threshold is not None:
+        params["conf"] = conf_threshold
+    with open(image_path, "rb") as f:
+        data = f.read()
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/predict?{urllib.parse.urlencode(params)}", data=data,
+        headers={"Content-Type": "application/octet-stream"}, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def client(args) -> int:
+    """并发发送图片并把返回的标注写入输出目录"""
+    url = f"http://{args.host}:{args.port}"
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    def run(image_path: str):
+        annotation = predict_file(url, image_path, args.conf)
+        if args.output_dir:
+            json_path = os.path.join(args.output_dir,
+                                     os.path.splitext(os.path.basename(image_path))[0] + ".json")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(annotation, f, indent=2, ensure_ascii=False)
+        return annotation
+
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(run, path): path for path in args.images}
+        for future, image_path in futures.items():
+            try:
+                annotation = future.result()
+                print(f"{image_path}: {len(annotation['shapes'])} detections")
+            except Exception as e:
+                failed += 1
+                print(f"Error processing {image_path}: {str(e)}")
+    elapsed = time.perf_counter() - start
+    print(f"Sent {len(args.images)} images in {elapsed:.2f}s, {failed} failed")
+
+    with urllib.request.urlopen(f"{url}/stats") as response:
+        print(json.dumps(json.loads(response.read().decode("utf-8")), indent=2))
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLOv8本地推理服务")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="加载模型并启动服务")
+    serve_parser.add_argument("model_path", help="YOLO模型文件路径 (.pt)")
+    serve_parser.add_argument("labels_file", help="标签文件路径 (labels.txt)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8765, help="监听端口 (默认: 8765)")
+    serve_parser.add_argument("--conf", "-c", type=float, default=0.25,
+                              help="默认置信度阈值 (默认: 0.25)")
+    serve_parser.add_argument("--backend", choices=["ultralytics", "onnxruntime"],
+                              default="ultralytics", help="推理后端 (默认: ultralytics)")
+    serve_parser.add_argument("--imgsz", type=int, default=640,
+                              help="onnxruntime 后端的输入尺寸 (默认: 640)")
+    serve_parser.add_argument("--max_batch_size", type=int, default=8,
+                              help="每批最多合并的请求数 (默认: 8)")
+    serve_parser.add_argument("--max_wait_ms", type=float, default=5.0,
+                              help="收集批次的最长等待时间，毫秒 (默认: 5)")
+    serve_parser.add_argument("--request_timeout", type=float, default=60.0,
+                              help="单个请求等待推理结果的超时时间，秒 (默认: 60)")
+    serve_parser.add_argument("--quiet", "-q", action="store_true", help="不打印访问日志")
+
+    client_parser = subparsers.add_parser("client", help="向本地服务发送图片")
+    client_parser.add_argument("images", nargs="+", help="图片路径")
+    client_parser.add_argument("--host", default="127.0.0.1", help="服务地址 (默认: 127.0.0.1)")
+    client_parser.add_argument("--port", type=int, default=8765, help="服务端口 (默认: 8765)")
+    client_parser.add_argument("--conf", "-c", type=float, default=None,
+                               help="置信度阈值 (默认使用服务端设置)")
+    client_parser.add_argument("--concurrency", type=int, default=8,
+                               help="并发请求数 (默认: 8)")
+    client_parser.add_argument("--output_dir", "-o", help="保存返回的标注JSON的目录")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        return serve(args)
+    return client(args)
+
+
+if __name__ == "__main__":
+    exit(main())
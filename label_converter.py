@@ -5,24 +5,23 @@ import os.path as osp
 import time
 import math
 
-from PIL import Image, ImageDraw
-from tqdm import tqdm
 from datetime import date
 
-import numpy as np
-import xml.dom.minidom as minidom
-import xml.etree.ElementTree as ET
-
 import sys
 
 sys.path.append(".")
+import image_header  # noqa: E402
 # from anylabeling.app_info import __version__  # noqa: E402
 
+# numpy, PIL, tqdm 和 XML 库只在需要它们的转换模式中导入，以加快命令行启动速度
+
 VERSION = "2.3.0"
 
 
 class JsonEncoder(json.JSONEncoder):
     def default(self, obj):
+        import numpy as np
+
         if isinstance(obj, (np.integer, np.floating, np.bool_)):
             return obj.item()
         elif isinstance(obj, np.ndarray):
@@ -52,9 +51,8 @@ class BaseLabelConverter:
         )
 
     def get_image_size(self, image_file):
-        with Image.open(image_file) as img:
-            width, height = img.size
-            return width, height
+        # 只解析文件头，尺寸在内存中缓存，不向图片目录写入索引
+        return image_header.get_image_size(image_file)
 
     def get_minimal_enclosing_rectangle(self, poly):
         assert len(poly) == 8, "Input rectangle must contain exactly 8 values."
@@ -133,6 +131,9 @@ class BaseLabelConverter:
 
 class RectLabelConverter(BaseLabelConverter):
     def custom_to_voc2017(self, input_file, output_dir):
+        import xml.dom.minidom as minidom
+        import xml.etree.ElementTree as ET
+
         with open(input_file, "r", encoding="utf-8") as f:
             data = json.load(f)
 
@@ -177,6 +178,8 @@ class RectLabelConverter(BaseLabelConverter):
             f.write(formatted_xml)
 
     def voc2017_to_custom(self, input_file, output_file):
+        import xml.etree.ElementTree as ET
+
         self.reset()
 
         tree = ET.parse(input_file)
@@ -292,6 +295,8 @@ class RectLabelConverter(BaseLabelConverter):
             json.dump(self.custom_data, f, indent=2, ensure_ascii=False)
 
     def custom_to_coco(self, input_path, output_path):
+        from tqdm import tqdm
+
         coco_data = self.get_coco_data()
 
         for i, class_name in enumerate(self.classes):
@@ -361,6 +366,8 @@ class RectLabelConverter(BaseLabelConverter):
             json.dump(coco_data, f, indent=4, ensure_ascii=False)
 
     def coco_to_custom(self, input_file, image_path):
+        from tqdm import tqdm
+
         img_dic = {}
         for file in os.listdir(image_path):
             img_dic[file] = file
@@ -439,6 +446,8 @@ class RectLabelConverter(BaseLabelConverter):
 
 class PolyLabelConvert(BaseLabelConverter):
     def mask2box(self, mask):
+        import numpy as np
+
         index = np.argwhere(mask == 1)
         rows = index[:, 0]
         clos = index[:, 1]
@@ -457,6 +466,9 @@ class PolyLabelConvert(BaseLabelConverter):
         )
 
     def polygons_to_mask(self, img_shape, polygons):
+        import numpy as np
+        from PIL import Image, ImageDraw
+
         mask = np.zeros(img_shape, dtype=np.uint8)
         mask = Image.fromarray(mask)
         xy = list(map(tuple, polygons))
@@ -465,6 +477,9 @@ class PolyLabelConvert(BaseLabelConverter):
         return mask
 
     def custom_to_coco(self, input_path, output_path):
+        import numpy as np
+        from tqdm import tqdm
+
         coco_data = self.get_coco_data()
 
         for i, class_name in enumerate(self.classes):
@@ -533,6 +548,8 @@ class PolyLabelConvert(BaseLabelConverter):
             )
 
     def custom_to_yolov5(self, input_file, output_file):
+        import numpy as np
+
         with open(input_file, "r", encoding="utf-8") as f:
             data = json.load(f)
 
@@ -558,6 +575,8 @@ class PolyLabelConvert(BaseLabelConverter):
                 )
 
     def yolov5_to_custom(self, input_file, output_file, image_file):
+        import numpy as np
+
         self.reset()
 
         with open(input_file, "r", encoding="utf-8") as f:
@@ -595,6 +614,8 @@ class PolyLabelConvert(BaseLabelConverter):
             json.dump(self.custom_data, f, indent=2, ensure_ascii=False)
 
     def coco_to_custom(self, input_file, image_path):
+        from tqdm import tqdm
+
         img_dic = {}
         for file in os.listdir(image_path):
             img_dic[file] = file
@@ -711,6 +732,8 @@ class RotateLabelConverter(BaseLabelConverter):
             json.dump(self.custom_data, f, indent=2, ensure_ascii=False)
 
     def dota_to_dcoco(self, input_path, output_path, image_path):
+        from tqdm import tqdm
+
         self.ensure_output_path(output_path, "json")
         coco_data = self.get_coco_data()
 
@@ -722,7 +745,9 @@ class RotateLabelConverter(BaseLabelConverter):
         image_id = 0
         annotation_id = 0
 
-        file_list = os.listdir(image_path)
+        file_list = [
+            f for f in os.listdir(image_path) if f != image_header.INDEX_FILENAME
+        ]
         for image_file in tqdm(
             file_list, desc="Converting files", unit="file", colour="green"
         ):
@@ -817,6 +842,8 @@ class RotateLabelConverter(BaseLabelConverter):
                     )
 
     def dxml_to_dota(self, input_file, output_file):
+        import xml.etree.ElementTree as ET
+
         tree = ET.parse(input_file)
         root = tree.getroot()
         with open(output_file, "w", encoding="utf-8") as f:
@@ -908,6 +935,8 @@ def main():
     )
     args = parser.parse_args()
 
+    from tqdm import tqdm
+
     print(f"Starting conversion to {args.mode} format of {args.task}...")
     start_time = time.time()
 
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+YOLOv8模型INT8量化脚本
+使用ONNX Runtime静态量化，以 data-prepare 生成的 yolodata/val/images 作为校准数据，
+并在 yolodata/val 上对比量化前后的推理速度和 mAP，帮助决定是否使用量化模型。
+
+生成的模型可直接用于 yolo_inference.py --backend onnxruntime。
+
+用法: python quantize_model.py <model_path> <yolodata_dir> [options]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from yolo_inference import (IMAGE_EXTENSIONS, Detections, OnnxYOLO, box_iou_matrix,
+                            decode_image, hash_file)
+
+# mAP50-95 使用的IOU阈值
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+# 从模型输出回溯时遇到这些算子即停止，它们及之前的节点照常量化
+QUANTIZED_HEAD_OPS = {"Conv", "MatMul", "Gemm"}
+
+
+def list_images(image_dir: str) -> List[str]:
+    """按文件名排序列出目录中的图片"""
+    return sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)
+                  if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def load_yolo_labels(label_file: str, image_size: Tuple[int, int]) -> Detections:
+    """读取YOLO格式的标注文件，转换为像素坐标的检测框
+
+    每行为 class cx cy w h（归一化坐标）；多边形标注 class x1 y1 x2 y2 ... 取外接矩形。
+
+    Args:
+        label_file: 标注文件路径，不存在时视为没有目标
+        image_size: 图片 (width, height)
+
+    Returns:
+        真值框，scores 均为1
+    """
+    boxes, class_ids = [], []
+    if os.path.exists(label_file):
+        with open(label_file, "r", encoding="utf-8") as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 5:
+                    continue
+                coords = np.array(values[1:], dtype=np.float64)
+                if len(coords) == 4:
+                    cx, cy, w, h = coords
+                    boxes.append([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+                else:
+                    points = coords[:len(coords) // 2 * 2].reshape(-1, 2)
+                    boxes.append([*points.min(axis=0), *points.max(axis=0)])
+                class_ids.append(int(values[0]))
+    width, height = image_size
+    xyxy = np.array(boxes, dtype=np.float64).reshape(-1, 4) * [width, height, width, height]
+    return Detections(xyxy, np.ones(len(class_ids)), np.array(class_ids))
+
+
+def match_predictions(predictions: Detections, targets: Detections) -> np.ndarray:
+    """在每个IOU阈值下将预测框与同类别的真值框一对一匹配
+
+    Returns:
+        (预测数, IOU阈值数) 的布尔数组，表示每个预测在各阈值下是否为TP
+    """
+    correct = np.zeros((len(predictions), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(predictions) or not len(targets):
+        return correct
+    iou = box_iou_matrix(targets.xyxy.astype(np.float64), predictions.xyxy.astype(np.float64))
+    iou = iou * (targets.class_ids[:, None] == predictions.class_ids[None, :])
+    for i, threshold in enumerate(IOU_THRESHOLDS):
+        target_idx, prediction_idx = np.nonzero(iou >= threshold)
+        if not len(target_idx):
+            continue
+        # 按IOU从高到低，每个预测和每个真值只匹配一次（与 ultralytics 验证时的匹配方式相同）
+        order = np.argsort(-iou[target_idx, prediction_idx], kind="stable")
+        target_idx, prediction_idx = target_idx[order], prediction_idx[order]
+        _, first = np.unique(prediction_idx, return_index=True)
+        target_idx, prediction_idx = target_idx[first], prediction_idx[first]
+        _, first = np.unique(target_idx, return_index=True)
+        correct[prediction_idx[first], i] = True
+    return correct
+
+
+def compute_ap(recall: np.ndarray, precision: np.ndarray) -> float:
+    """按COCO的101点插值计算AP"""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    y = np.interp(x, mrec, mpre)
+    return float(((y[1:] + y[:-1]) / 2 * np.diff(x)).sum())  # 梯形积分
+
+
+def mean_average_precision(correct: np.ndarray, scores: np.ndarray, pred_classes: np.ndarray,
+                           target_classes: np.ndarray) -> Tuple[float, float]:
+    """计算 mAP50 和 mAP50-95，只统计在真值中出现的类别
+
+    Args:
+        correct: (预测数, IOU阈值数) 的TP标记
+        scores: 预测置信度
+        pred_classes: 预测类别
+        target_classes: 全部真值的类别
+
+    Returns:
+        (mAP50, mAP50-95)
+    """
+    classes = np.unique(target_classes)
+    if not len(classes):
+        return 0.0, 0.0
+    order = np.argsort(-scores, kind="stable")
+    correct, pred_classes = correct[order], pred_classes[order]
+    ap = np.zeros((len(classes), len(IOU_THRESHOLDS)))
+    for ci, class_id in enumerate(classes):
+        mask = pred_classes == class_id
+        target_count = int((target_classes == class_id).sum())
+        if not mask.any():
+            continue
+        tp = np.cumsum(correct[mask], axis=0)
+        fp = np.cumsum(~correct[mask], axis=0)
+        recall = tp / (target_count + 1e-16)
+        precision = tp / (tp + fp)
+        for j in range(len(IOU_THRESHOLDS)):
+            ap[ci, j] = compute_ap(recall[:, j], precision[:, j])
+    return float(ap[:, 0].mean()), float(ap.mean())
+
+
+def evaluate(model: OnnxYOLO, image_paths: List[str], label_dir: str,
+             conf_threshold: float = 0.001, warmup: int = 3) -> Dict[str, float]:
+    """逐张推理验证集，统计单张图片推理耗时和mAP
+
+    Args:
+        model: ONNX模型
+        image_paths: 验证集图片
+        label_dir: YOLO格式标注目录
+        conf_threshold: 评估用的置信度阈值
+        warmup: 计时前的预热次数
+
+    Returns:
+        包含 ms_per_image、map50、map50_95 的字典
+    """
+    if image_paths:
+        warmup_image = decode_image(image_paths[0])
+        for _ in range(warmup):
+            model(warmup_image, conf=conf_threshold)
+
+    elapsed = 0.0
+    corrects, scores, pred_classes, target_classes = [], [], [], []
+    for image_path in image_paths:
+        image = decode_image(image_path)
+        start = time.perf_counter()
+        result = model(image, conf=conf_threshold)[0]
+        elapsed += time.perf_counter() - start
+
+        predictions = Detections.from_result(result)
+        label_file = os.path.join(label_dir, os.path.splitext(os.path.basename(image_path))[0] + ".txt")
+        targets = load_yolo_labels(label_file, (image.shape[1], image.shape[0]))
+        corrects.append(match_predictions(predictions, targets))
+        scores.append(predictions.scores)
+        pred_classes.append(predictions.class_ids)
+        target_classes.append(targets.class_ids)
+
+    map50, map50_95 = mean_average_precision(
+        np.concatenate(corrects) if corrects else np.zeros((0, len(IOU_THRESHOLDS)), bool),
+        np.concatenate(scores) if scores else np.zeros(0),
+        np.concatenate(pred_classes) if pred_classes else np.zeros(0, np.int64),
+        np.concatenate(target_classes) if target_classes else np.zeros(0, np.int64))
+    return {
+        "ms_per_image": elapsed * 1000.0 / max(1, len(image_paths)),
+        "map50": map50,
+        "map50_95": map50_95,
+    }
+
+
+class LetterboxCalibrationReader:
+    """为ONNX Runtime静态量化逐张提供letterbox后的校准图片"""
+
+    def __init__(self, model: OnnxYOLO, image_paths: List[str]):
+        """初始化
+
+        Args:
+            model: fp32 模型，用于获取输入名称和letterbox预处理
+            image_paths: 校准图片
+        """
+        self.model = model
+        self.image_paths = iter(image_paths)
+
+    def get_next(self) -> Optional[dict]:
+        image_path = next(self.image_paths, None)
+        if image_path is None:
+            return None
+        tensor, _, _ = self.model.letterbox(decode_image(image_path))
+        return {self.model.input_name: tensor[None]}
+
+
+def head_nodes_to_exclude(model) -> List[str]:
+    """找出输出头中最后的卷积之后的节点，量化时保留为浮点计算
+
+    YOLOv8 的 output0 把像素坐标（0~imgsz）和 Sigmoid 后的类别置信度（0~1）拼接在同一个张量中，
+    共用一组量化参数时置信度几乎全部被量化为0。从模型输出向前回溯到 Conv/MatMul/Gemm 为止，
+    经过的 DFL 解码（Sub/Add/Div/Mul）、Sigmoid、Concat 等节点都不量化。
+
+    Args:
+        model: onnx ModelProto，所有节点都需要有名称
+
+    Returns:
+        不量化的节点名称列表
+    """
+    producers = {output: node for node in model.graph.node for output in node.output}
+    excluded = {}
+    pending = [output.name for output in model.graph.output]
+    while pending:
+        node = producers.get(pending.pop())
+        if node is None or node.name in excluded or node.op_type in QUANTIZED_HEAD_OPS:
+            continue
+        excluded[node.name] = None
+        pending.extend(name for name in node.input if name)
+    return list(excluded)
+
+
+def quantize(onnx_path: str, output_path: str, calibration_images: List[str], imgsz: int,
+             calibrate_method: str = "minmax", per_channel: bool = False):
+    """对fp32 ONNX模型做INT8静态量化（QDQ格式），并保留模型元数据中的类别名称
+
+    Args:
+        onnx_path: fp32 ONNX模型路径
+        output_path: INT8模型输出路径
+        calibration_images: 校准图片
+        imgsz: 输入尺寸
+        calibrate_method: 校准方法，minmax、entropy 或 percentile
+        per_channel: 是否按通道量化权重
+    """
+    try:
+        import onnx
+        from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod,
+                                              QuantFormat, QuantType, quantize_static)
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        raise ImportError("请安装onnx和onnxruntime: pip install onnx onnxruntime")
+
+    class Reader(LetterboxCalibrationReader, CalibrationDataReader):
+        pass
+
+    methods = {"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+               "percentile": CalibrationMethod.Percentile}
+    fp32_model = OnnxYOLO(onnx_path, imgsz)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 量化前先做形状推断和图优化，失败时直接量化原模型
+        model_input = os.path.join(tmp_dir, "preprocessed.onnx")
+        try:
+            quant_pre_process(onnx_path, model_input)
+        except Exception as e:
+            print(f"Warning: quantization pre-processing failed ({str(e)}), using the original model")
+            model_input = onnx_path
+
+        # 按名称排除输出头的节点，先给没有名称的节点命名
+        model = onnx.load(model_input)
+        unnamed = [node for node in model.graph.node if not node.name]
+        for index, node in enumerate(unnamed):
+            node.name = f"{node.op_type}_unnamed_{index}"
+        if unnamed:
+            model_input = os.path.join(tmp_dir, "named.onnx")
+            onnx.save(model, model_input)
+        nodes_to_exclude = head_nodes_to_exclude(model)
+        print(f"Keeping {len(nodes_to_exclude)} output head nodes in float")
+
+        quantize_static(model_input, output_path, Reader(fp32_model, calibration_images),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, per_channel=per_channel,
+                        calibrate_method=methods[calibrate_method],
+                        nodes_to_exclude=nodes_to_exclude)
+
+    # OnnxYOLO 从元数据中读取类别名称
+    source = onnx.load(onnx_path, load_external_data=False)
+    quantized = onnx.load(output_path)
+    existing = {prop.key for prop in quantized.metadata_props}
+    for prop in source.metadata_props:
+        if prop.key not in existing:
+            quantized.metadata_props.add(key=prop.key, value=prop.value)
+    onnx.save(quantized, output_path)
+
+
+def sample_evenly(items: list, count: int) -> list:
+    """从列表中等间隔选取最多count个元素，count<=0时返回全部"""
+    if count <= 0 or count >= len(items):
+        return list(items)
+    return [items[i] for i in np.linspace(0, len(items) - 1, count).round().astype(int)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLOv8模型INT8量化")
+    parser.add_argument("model_path", help="YOLO模型文件路径 (.pt 或 .onnx)")
+    parser.add_argument("yolodata_dir", help="data-prepare 生成的 yolodata 目录，使用其中的 val/images 和 val/labels")
+    parser.add_argument("--output", "-o", help="INT8模型输出路径 (默认: 模型旁边的 <名称>.int8.onnx)")
+    parser.add_argument("--imgsz", type=int, default=640, help="输入尺寸 (默认: 640)")
+    parser.add_argument("--calib_images", type=int, default=200,
+                        help="校准图片数量，从验证集中等间隔选取，0表示全部 (默认: 200)")
+    parser.add_argument("--calibrate_method", choices=["minmax", "entropy", "percentile"],
+                        default="minmax", help="校准方法 (默认: minmax)")
+    parser.add_argument("--per_channel", action="store_true", help="按通道量化权重")
+    parser.add_argument("--eval_images", type=int, default=0,
+                        help="评估使用的验证集图片数量，0表示全部 (默认: 0)")
+    parser.add_argument("--no_eval", action="store_true", help="只量化，不评估速度和mAP")
+    args = parser.parse_args()
+
+    val_images_dir = os.path.join(args.yolodata_dir, "val", "images")
+    val_labels_dir = os.path.join(args.yolodata_dir, "val", "labels")
+    if not os.path.exists(args.model_path):
+        print(f"模型文件不存在: {args.model_path}")
+        return 1
+    if not os.path.isdir(val_images_dir):
+        print(f"验证集图片目录不存在: {val_images_dir}")
+        return 1
+    val_images = list_images(val_images_dir)
+    if not val_images:
+        print(f"验证集中没有图片: {val_images_dir}")
+        return 1
+
+    try:
+        if args.model_path.endswith(".onnx"):
+            onnx_path = args.model_path
+        else:
+            onnx_path = OnnxYOLO.export(args.model_path, args.imgsz, hash_file(args.model_path))
+        output_path = args.output or f"{os.path.splitext(onnx_path)[0]}.int8.onnx"
+
+        calibration_images = sample_evenly(val_images, args.calib_images)
+        print(f"Calibrating on {len(calibration_images)} images from {val_images_dir}")
+        quantize(onnx_path, output_path, calibration_images, args.imgsz,
+                 args.calibrate_method, args.per_channel)
+        print(f"Saved INT8 model: {output_path} "
+              f"({os.path.getsize(onnx_path) / 1e6:.1f} MB -> {os.path.getsize(output_path) / 1e6:.1f} MB)")
+
+        if args.no_eval:
+            return 0
+
+        eval_images = sample_evenly(val_images, args.eval_images)
+        print(f"Evaluating on {len(eval_images)} images...")
+        # 单线程对比，结果更稳定，也更接近多进程部署时每个进程的情况
+        fp32 = evaluate(OnnxYOLO(onnx_path, args.imgsz, num_threads=1),
+                        eval_images, val_labels_dir)
+        int8 = evaluate(OnnxYOLO(output_path, args.imgsz, num_threads=1),
+                        eval_images, val_labels_dir)
+    except Exception as e:
+        print(f"处理过程中出错: {str(e)}")
+        return 1
+
+    print(f"{'model':<6} {'ms/image':>9} {'mAP50':>8} {'mAP50-95':>9}")
+    for name, stats in (("fp32", fp32), ("int8", int8)):
+        print(f"{name:<6} {stats['ms_per_image']:>9.2f} {stats['map50']:>8.4f} "
+              f"{stats['map50_95']:>9.4f}")
+    speedup = fp32["ms_per_image"] / int8["ms_per_image"] if int8["ms_per_image"] else 0.0
+    print(f"Speed-up: {speedup:.2f}x, mAP50 delta: {int8['map50'] - fp32['map50']:+.4f}, "
+          f"mAP50-95 delta: {int8['map50_95'] - fp32['map50_95']:+.4f}")
+    print(f"Run it with: python yolo_inference.py {output_path} <labels.txt> <image_dir> "
+          f"--backend onnxruntime --imgsz {args.imgsz}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""perceptual_hash 返回的尺寸必须与 decode_image 解码后的图片一致（包括EXIF旋转）"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from yolo_inference import ArchiveMember, decode_image, perceptual_hash
+
+
+def save_rotated(path, orientation):
+    """保存一张 60x40 的图片，EXIF方向为 orientation"""
+    rng = np.random.default_rng(0)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    Image.fromarray(rng.integers(0, 256, (40, 60, 3), dtype=np.uint8)).save(path, exif=exif)
+
+
+@pytest.mark.parametrize("extension", ["tif", "png", "jpg"])
+@pytest.mark.parametrize("orientation", [1, 3, 6, 8])
+def test_size_matches_decoded_image(tmp_path, extension, orientation):
+    path = str(tmp_path / f"rotated.{extension}")
+    save_rotated(path, orientation)
+
+    _, size = perceptual_hash(path)
+
+    decoded = decode_image(path)
+    assert size == (decoded.shape[1], decoded.shape[0])
+
+
+def test_archive_member_matches_file(tmp_path):
+    path = str(tmp_path / "rotated.tif")
+    save_rotated(path, 6)
+    with open(path, "rb") as f:
+        member = ArchiveMember(str(tmp_path / "images.zip"), "rotated.tif", f.read())
+
+    assert perceptual_hash(member) == perceptual_hash(path)
+    assert perceptual_hash(member)[1] == (40, 60)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""quantize_model.py 的INT8量化测试：输出头中混合值域的拼接不能把置信度量化为0"""
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+ort = pytest.importorskip("onnxruntime")
+pytest.importorskip("onnxruntime.quantization")
+from onnx import TensorProto, helper, numpy_helper  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from quantize_model import head_nodes_to_exclude, quantize  # noqa: E402
+
+IMGSZ = 32
+NUM_CLASSES = 2
+
+
+def build_mixed_range_head(path):
+    """构造一个与YOLOv8输出头结构相同的小模型
+
+    output0 为 (1, 4 + 类别数, 锚点数)，前4行是放大到像素尺度的坐标（0~640），
+    其余是Sigmoid后的类别置信度（0~1），两者在最后的Concat中拼接。
+    """
+    rng = np.random.default_rng(0)
+    anchors = (IMGSZ // 2) ** 2
+    initializers = [
+        numpy_helper.from_array(rng.normal(0, 0.3, (8, 3, 3, 3)).astype(np.float32), "w_stem"),
+        numpy_helper.from_array(np.zeros(8, dtype=np.float32), "b_stem"),
+        numpy_helper.from_array(rng.normal(0, 0.3, (4, 8, 1, 1)).astype(np.float32), "w_box"),
+        numpy_helper.from_array(rng.normal(0, 0.3, (NUM_CLASSES, 8, 1, 1)).astype(np.float32),
+                                "w_cls"),
+        numpy_helper.from_array(np.array([1, 4, anchors], dtype=np.int64), "box_shape"),
+        numpy_helper.from_array(np.array([1, NUM_CLASSES, anchors], dtype=np.int64), "cls_shape"),
+        numpy_helper.from_array(np.array(640, dtype=np.float32), "scale"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["images", "w_stem", "b_stem"], ["stem"], name="stem",
+                         kernel_shape=[3, 3], pads=[1, 1, 1, 1], strides=[2, 2]),
+        helper.make_node("Relu", ["stem"], ["stem_act"], name="stem_act"),
+        helper.make_node("Conv", ["stem_act", "w_box"], ["box_raw"], name="box_conv"),
+        helper.make_node("Conv", ["stem_act", "w_cls"], ["cls_raw"], name="cls_conv"),
+        helper.make_node("Reshape", ["box_raw", "box_shape"], ["box_flat"], name="box_reshape"),
+        helper.make_node("Sigmoid", ["box_flat"], ["box_unit"], name="box_sigmoid"),
+        helper.make_node("Mul", ["box_unit", "scale"], ["box"], name="box_scale"),
+        helper.make_node("Reshape", ["cls_raw", "cls_shape"], ["cls_flat"], name="cls_reshape"),
+        helper.make_node("Sigmoid", ["cls_flat"], ["cls"], name="cls_sigmoid"),
+        helper.make_node("Concat", ["box", "cls"], ["output0"], name="concat", axis=1),
+    ]
+    graph = helper.make_graph(
+        nodes, "mixed_range_head",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, IMGSZ, IMGSZ])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT,
+                                       [1, 4 + NUM_CLASSES, anchors])],
+        initializer=initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    helper.set_model_props(model, {"names": "{0: 'a', 1: 'b'}"})
+    onnx.save(model, path)
+
+
+def test_head_nodes_to_exclude_stops_at_conv(tmp_path):
+    model_path = str(tmp_path / "head.onnx")
+    build_mixed_range_head(model_path)
+
+    excluded = head_nodes_to_exclude(onnx.load(model_path))
+
+    assert set(excluded) == {"concat", "box_scale", "box_sigmoid", "box_reshape",
+                             "cls_sigmoid", "cls_reshape"}
+
+
+def test_quantized_scores_are_not_collapsed(tmp_path):
+    model_path = str(tmp_path / "head.onnx")
+    build_mixed_range_head(model_path)
+    rng = np.random.default_rng(1)
+    images = []
+    for index in range(8):
+        image_path = str(tmp_path / f"calib_{index}.png")
+        Image.fromarray(rng.integers(0, 256, (IMGSZ, IMGSZ, 3), dtype=np.uint8)).save(image_path)
+        images.append(image_path)
+    output_path = str(tmp_path / "head.int8.onnx")
+
+    quantize(model_path, output_path, images, IMGSZ)
+
+    inputs = {"images": rng.random((1, 3, IMGSZ, IMGSZ), dtype=np.float32)}
+    fp32 = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"]).run(
+        None, inputs)[0]
+    int8 = ort.InferenceSession(output_path, providers=["CPUExecutionProvider"]).run(
+        None, inputs)[0]
+    scores_fp32, scores_int8 = fp32[0, 4:], int8[0, 4:]
+    assert scores_int8.max() > 0.1
+    np.testing.assert_allclose(scores_int8, scores_fp32, atol=0.05)
@@ -6,34 +6,2238 @@ YOLOv8模型推理脚本
 """
 
 import argparse
+import ast
+import glob
+import hashlib
+import io
 import json
+import multiprocessing
 import os
+import queue
+import random
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Callable, Iterable, Iterator, List, Tuple, Optional, Union
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw, ImageOps
 
-# 导入YOLOv8相关库
-try:
-    from ultralytics import YOLO
-except ImportError:
-    print("请安装ultralytics: pip install ultralytics")
-    exit(1)
+import image_header
+
+
+# 支持的图片格式
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
+
+
+def import_yolo():
+    """按需导入YOLOv8相关库
+
+    ultralytics 会连带加载 torch，耗时远超脚本其余部分，因此只在真正加载模型时才导入，
+    --help 和参数检查不会加载 torch。
+
+    Returns:
+        ultralytics.YOLO 类
+    """
+    try:
+        from ultralytics import YOLO
+    except ImportError:
+        raise ImportError("请安装ultralytics: pip install ultralytics")
+    return YOLO
+
+
+def is_image_file(path: str) -> bool:
+    """根据扩展名判断是否为支持的图片文件"""
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_image_files(image_dir: str) -> Iterator[str]:
+    """基于 os.scandir 递归遍历目录，边遍历边产出图片路径
+
+    不会预先构建完整的路径列表，目录中有数百万文件时也能立即开始处理，内存占用与文件数无关。
+
+    Args:
+        image_dir: 图片目录
+
+    Yields:
+        图片路径
+    """
+    pending_dirs = [image_dir]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif is_image_file(entry.name) and entry.is_file():
+                        yield entry.path
+        except OSError as e:
+            print(f"Error scanning {current_dir}: {str(e)}")
+            continue
+        # 逆序入栈，使子目录按遍历到的顺序处理
+        pending_dirs.extend(reversed(subdirs))
+
+
+def iter_file_list(list_file: str) -> Iterator[str]:
+    """逐行读取图片路径列表，"-" 表示从标准输入读取
+
+    Args:
+        list_file: 每行一个图片路径的文本文件
+
+    Yields:
+        图片路径
+    """
+    if list_file == "-":
+        for line in sys.stdin:
+            path = line.strip()
+            if path:
+                yield path
+        return
+    with open(list_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            path = line.strip()
+            if path:
+                yield path
+
+
+class ArchiveMember(str):
+    """压缩包中的一张图片
+
+    字符串值为 "<压缩包路径>/<成员路径>"，可以像普通图片路径一样在流水线中传递，
+    相对压缩包路径即为成员路径；图片数据保存在内存中，读取时不需要临时文件。
+    """
+
+    def __new__(cls, archive_path: str, member_name: str, data: bytes):
+        member = super().__new__(cls, os.path.join(archive_path, *member_name.split("/")))
+        member.archive_path = archive_path
+        member.member_name = member_name
+        member.data = data
+        return member
+
+    def __reduce__(self):
+        # 多进程推理时连同图片数据一起传给子进程
+        return ArchiveMember, (self.archive_path, self.member_name, self.data)
+
+    def open(self) -> io.BytesIO:
+        """以只读的内存文件对象打开图片数据"""
+        return io.BytesIO(self.data)
+
+
+def is_archive_file(path: str) -> bool:
+    """判断是否为支持的图片压缩包（zip 或 tar，包括 .tar.gz 等压缩的tar）"""
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def iter_archive_images(archive_path: str) -> Iterator[ArchiveMember]:
+    """按存储顺序顺序读取压缩包中的图片，不解压到磁盘
+
+    tar 以流模式读取，只顺序读一遍文件，也支持 gzip/bz2/xz 压缩；zip 按中央目录顺序读取。
+
+    Args:
+        archive_path: .zip 或 .tar(.gz/.bz2/.xz) 文件路径
+
+    Yields:
+        ArchiveMember
+    """
+    def is_image_member(name: str) -> bool:
+        # 跳过 macOS 打包时附带的资源文件
+        return is_image_file(name) and not name.startswith("__MACOSX/") and \
+            not os.path.basename(name).startswith("._")
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image_member(info.filename):
+                    yield ArchiveMember(archive_path, info.filename, archive.read(info))
+        return
+
+    with tarfile.open(archive_path, "r|*") as archive:
+        for member in archive:
+            if member.isfile() and is_image_member(member.name):
+                yield ArchiveMember(archive_path, member.name,
+                                    archive.extractfile(member).read())
+
+
+def iter_glob(patterns: List[str]) -> Iterator[str]:
+    """按glob模式（支持 ** 递归）逐个产出匹配的图片路径
+
+    Args:
+        patterns: glob模式列表
+
+    Yields:
+        图片路径
+    """
+    for pattern in patterns:
+        for path in glob.iglob(pattern, recursive=True):
+            if is_image_file(path) and os.path.isfile(path):
+                yield path
+
+
+def iter_video_frames(video_path: str, frame_stride: int = 1) -> Iterator[Tuple[int, np.ndarray]]:
+    """顺序解码视频，每隔 frame_stride 帧产出一帧
+
+    Args:
+        video_path: 视频文件路径
+        frame_stride: 帧间隔，1表示每一帧
+
+    Yields:
+        (帧序号, HxWx3 的 BGR 数组)
+    """
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+    try:
+        frame_index = 0
+        while True:
+            if frame_index % frame_stride == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield frame_index, frame
+            elif not capture.grab():  # 跳过的帧只 grab，不做颜色转换
+                break
+            frame_index += 1
+    finally:
+        capture.release()
+
+
+def motion_thumbnail(frame: np.ndarray, width: int = 64) -> np.ndarray:
+    """生成用于运动检测的低分辨率灰度缩略图
+
+    Args:
+        frame: HxWx3 的 BGR 数组
+        width: 缩略图宽度
+
+    Returns:
+        float32 灰度缩略图
+    """
+    import cv2
+
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+
+def perceptual_hash(image_path: str, hash_size: int = 8) -> Tuple[int, Tuple[int, int]]:
+    """计算图片的差值哈希 (dHash)，用于查找近似重复的图片
+
+    JPEG 使用 draft 模式按 1/2~1/8 比例解码，远快于完整解码。
+
+    Args:
+        image_path: 图片路径
+        hash_size: 哈希边长，哈希位数为 hash_size * hash_size
+
+    Returns:
+        (哈希整数, 按EXIF方向旋转后的 (width, height))，尺寸与 decode_image 结果一致
+    """
+    source = image_path.open() if isinstance(image_path, ArchiveMember) else image_path
+    # PIL 对部分格式（如TIFF）已经按方向转置了 img.size，尺寸统一由 image_header 按EXIF方向计算
+    width, height = image_header.read_image_size_or_decode(source, exif_transpose=True)
+    if isinstance(image_path, ArchiveMember):
+        source.seek(0)
+    with Image.open(source) as img:
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        gray = ImageOps.exif_transpose(img).convert("L").resize(
+            (hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).reshape(-1)
+    return int("".join("1" if bit else "0" for bit in bits), 2), (width, height)
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    """将序列按固定大小分组，最后一组可能不足batch_size
+
+    Args:
+        items: 任意可迭代对象
+        batch_size: 每组元素数量
+
+    Yields:
+        元素列表
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class StageTimer:
+    """按流水线阶段统计耗时：次数、总时间和 p50/p95/p99
+
+    每个阶段的耗时按图片记录，分位数基于最多 max_samples 个水塘抽样样本。
+    未指定输出时整个计时器关闭，stage() 返回空的上下文管理器，开销可以忽略。
+    可以在多个线程中同时使用。
+    """
+
+    STAGES = ("discovery", "cache", "phash", "json_read", "decode", "preprocess", "forward",
+              "postprocess", "dedupe", "write", "render")
+
+    _DISABLED = nullcontext()
+
+    def __init__(self, output: Optional[str] = None, interval: float = 30.0,
+                 max_samples: int = 100000):
+        """初始化
+
+        Args:
+            output: 报告输出位置：JSON文件路径，"-" 表示每次以一行JSON写入标准错误，
+                None表示关闭计时
+            interval: 运行过程中输出报告的间隔（秒），0表示只在结束时输出
+            max_samples: 每个阶段保留的样本数上限
+        """
+        self.output = output
+        self.enabled = output is not None
+        self.interval = interval
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.totals = {}
+        self.samples = {}
+        self.start_time = time.perf_counter()
+        self.last_emit = self.start_time
+
+    def add(self, stage: str, seconds: float, count: int = 1):
+        """记录 count 张图片在某个阶段的耗时，每张图片耗时为 seconds / count
+
+        Args:
+            stage: 阶段名
+            seconds: 总耗时（秒）
+            count: 图片数
+        """
+        if not self.enabled or count <= 0:
+            return
+        per_item = seconds / count
+        with self.lock:
+            seen = self.counts.get(stage, 0)
+            self.counts[stage] = seen + count
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            samples = self.samples.setdefault(stage, [])
+            for i in range(seen, seen + count):
+                if len(samples) < self.max_samples:
+                    samples.append(per_item)
+                else:
+                    j = random.randrange(i + 1)
+                    if j < self.max_samples:
+                        samples[j] = per_item
+
+    def stage(self, stage: str):
+        """计时上下文管理器：with timer.stage("decode"): ..."""
+        if not self.enabled:
+            return self._DISABLED
+        return self._timed(stage)
+
+    @contextmanager
+    def _timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def iterate(self, stage: str, items: Iterable) -> Iterator:
+        """逐个产出 items 的元素，并把取得每个元素的耗时记入 stage"""
+        if not self.enabled:
+            yield from items
+            return
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def report(self, **extra) -> dict:
+        """生成报告字典
+
+        Args:
+            **extra: 附加到报告顶层的字段，例如已处理的图片数
+
+        Returns:
+            报告字典，各阶段时间单位为毫秒（total为秒）
+        """
+        elapsed = time.perf_counter() - self.start_time
+        stages = {}
+        with self.lock:
+            names = [name for name in self.STAGES if name in self.counts] + \
+                    sorted(set(self.counts) - set(self.STAGES))
+            for name in names:
+                samples = np.array(self.samples[name], dtype=np.float64) * 1000.0
+                p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+                stages[name] = {
+                    "count": self.counts[name],
+                    "total_s": round(self.totals[name], 6),
+                    "mean_ms": round(self.totals[name] * 1000.0 / self.counts[name], 4),
+                    "p50_ms": round(float(p50), 4),
+                    "p95_ms": round(float(p95), 4),
+                    "p99_ms": round(float(p99), 4),
+                }
+        if "images" in extra and elapsed > 0:
+            extra["images_per_s"] = round(extra["images"] / elapsed, 3)
+        return {"elapsed_s": round(elapsed, 3), **extra, "stages": stages}
+
+    def emit(self, final: bool = False, **extra):
+        """输出一次报告
+
+        Args:
+            final: 是否为运行结束时的最终报告
+            **extra: 附加字段
+        """
+        if not self.enabled:
+            return
+        self.last_emit = time.perf_counter()
+        report = self.report(final=final, **extra)
+        if self.output == "-":
+            print(json.dumps(report, ensure_ascii=False), file=sys.stderr, flush=True)
+        else:
+            write_json_atomic(self.output, report)
+
+    def maybe_emit(self, **extra):
+        """距离上次输出超过 interval 秒时输出一次中间报告"""
+        if self.enabled and self.interval > 0 and \
+                time.perf_counter() - self.last_emit >= self.interval:
+            self.emit(**extra)
+
+
+def decode_image(image_path: str) -> np.ndarray:
+    """读取并解码图片为BGR格式的numpy数组（与cv2.imread一致）
+
+    Args:
+        image_path: 图片路径
+
+    Returns:
+        HxWx3 的 uint8 BGR 数组
+    """
+    source = image_path.open() if isinstance(image_path, ArchiveMember) else image_path
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        return np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+
+
+def tile_starts(length: int, tile_size: int, stride: int) -> List[int]:
+    """计算一个维度上各切片的起始位置，最后一块与边缘对齐以覆盖整幅图片
+
+    Args:
+        length: 图片在该维度上的长度
+        tile_size: 切片大小
+        stride: 切片步长
+
+    Returns:
+        起始位置列表
+    """
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def make_tiles(image: np.ndarray, tile_size: int,
+               stride: int) -> Tuple[List[np.ndarray], np.ndarray]:
+    """将图片切分为互相重叠的切片，切片是原数组的视图而不是拷贝
+
+    Args:
+        image: HxWxC 的图片数组
+        tile_size: 切片大小
+        stride: 切片步长
+
+    Returns:
+        (切片列表, (K, 2) 的切片左上角偏移 [x, y])
+    """
+    height, width = image.shape[:2]
+    tiles, offsets = [], []
+    for y in tile_starts(height, tile_size, stride):
+        for x in tile_starts(width, tile_size, stride):
+            tiles.append(image[y:y + tile_size, x:x + tile_size])
+            offsets.append((x, y))
+    return tiles, np.array(offsets, dtype=np.float32).reshape(-1, 2)
+
+
+class ImagePrefetcher:
+    """使用线程池提前解码后续图片，解码与模型推理重叠进行
+
+    同一时刻最多有 queue_depth 张图片处于解码中或已解码待取状态，
+    因此处理超大目录时内存占用也是有上限的。结果按输入顺序返回。
+    """
+
+    def __init__(self, image_paths: Iterable[str], num_workers: int = 2,
+                 queue_depth: int = 8, timer: Optional[StageTimer] = None,
+                 loader: Callable[[str], object] = decode_image):
+        """初始化预取器
+
+        Args:
+            image_paths: 图片路径序列
+            num_workers: 解码线程数
+            queue_depth: 预取队列深度
+            timer: 记录解码耗时的计时器
+            loader: 读取单张图片的函数，默认解码为BGR数组
+        """
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be >= 1, got {num_workers}")
+        if queue_depth < 1:
+            raise ValueError(f"queue_depth must be >= 1, got {queue_depth}")
+        self.image_paths = image_paths
+        self.num_workers = num_workers
+        self.queue_depth = queue_depth
+        self.timer = timer or StageTimer()
+        self.loader = loader
+
+    def __iter__(self) -> Iterator[Tuple[str, Optional[np.ndarray], Optional[Exception]]]:
+        """按顺序产出 (图片路径, 解码后的数组, 解码异常)"""
+        pending = deque()
+        paths = iter(self.image_paths)
+        with ThreadPoolExecutor(max_workers=self.num_workers,
+                                thread_name_prefix="decode") as executor:
+            try:
+                for image_path in paths:
+                    pending.append((image_path, executor.submit(self._decode, image_path)))
+                    if len(pending) >= self.queue_depth:
+                        yield self._take(pending)
+                while pending:
+                    yield self._take(pending)
+            finally:
+                # 提前退出时取消尚未开始的解码任务
+                for _, future in pending:
+                    future.cancel()
+
+    def _decode(self, image_path: str) -> np.ndarray:
+        with self.timer.stage("decode"):
+            return self.loader(image_path)
+
+    @staticmethod
+    def _take(pending: deque):
+        image_path, future = pending.popleft()
+        try:
+            return image_path, future.result(), None
+        except Exception as e:
+            return image_path, None, e
+
+
+class AnnotatedImage:
+    """不依赖ultralytics结果对象的渲染器，用于切片推理等合并后的检测结果
+
+    提供与 ultralytics Results 相同的 save(filename=...) 接口，可直接交给 ResultRenderer。
+    """
+
+    def __init__(self, image: Optional[np.ndarray], detections: "Detections", labels: List[str],
+                 orig_shape: Optional[Tuple[int, int]] = None, image_path: Optional[str] = None):
+        """初始化
+
+        Args:
+            image: HxWx3 的 BGR 图片数组，为None时（例如从张量缓存推理）渲染前从 image_path 解码
+            detections: 检测结果
+            labels: 标签列表
+            orig_shape: 原图 (高, 宽)，image 为None时必须提供
+            image_path: 图片路径
+        """
+        self.image = image
+        self.detections = detections
+        self.labels = labels
+        self.image_path = image_path
+        self._orig_shape = orig_shape
+        self.speed = None
+
+    @property
+    def orig_shape(self) -> Tuple[int, int]:
+        """原图的 (height, width)，与 ultralytics Results.orig_shape 一致"""
+        if self.image is None:
+            return self._orig_shape
+        return self.image.shape[:2]
+
+    def save(self, filename: str):
+        """在图片上绘制检测框并保存"""
+        image = self.image if self.image is not None else decode_image(self.image_path)
+        canvas = Image.fromarray(np.ascontiguousarray(image[:, :, ::-1]))
+        draw = ImageDraw.Draw(canvas)
+        names = self.detections.label_names(self.labels).tolist()
+        for (x1, y1, x2, y2), score, name in zip(self.detections.xyxy.tolist(),
+                                                 self.detections.scores.tolist(), names):
+            draw.rectangle([x1, y1, x2, y2], outline=(255, 0, 0), width=2)
+            draw.text((x1 + 2, max(0.0, y1 - 12)), f"{name} {score:.2f}", fill=(255, 0, 0))
+        canvas.save(filename)
+
+
+class ResultRenderer:
+    """后台线程渲染推理结果图片，避免阻塞下一次推理"""
+
+    def __init__(self, max_pending: int = 8, timer: Optional[StageTimer] = None):
+        """初始化渲染器
+
+        Args:
+            max_pending: 最多排队等待渲染的结果数量，超过时阻塞以限制内存占用
+            timer: 记录渲染耗时的计时器
+        """
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        self.timer = timer or StageTimer()
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.errors = []
+
+    def submit(self, result, filename: str):
+        """提交一个推理结果进行渲染
+
+        Args:
+            result: ultralytics Results 对象
+            filename: 输出图片路径
+        """
+        while len(self.pending) >= self.max_pending:
+            self._wait_oldest()
+        future = self.executor.submit(self._render, result, filename)
+        self.pending.append((filename, future))
+
+    def _render(self, result, filename: str):
+        with self.timer.stage("render"):
+            result.save(filename=filename)
+
+    def _wait_oldest(self):
+        filename, future = self.pending.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error rendering {filename}: {str(e)}")
+            self.errors.append((filename, str(e)))
+
+    def close(self) -> List[Tuple[str, str]]:
+        """等待所有渲染完成并关闭线程
+
+        Returns:
+            渲染失败的 (文件名, 错误信息) 列表
+        """
+        while self.pending:
+            self._wait_oldest()
+        self.executor.shutdown(wait=True)
+        return self.errors
+
+
+class Detections:
+    """单张图片检测结果的紧凑数组存储
+
+    检测框、置信度和类别索引分别保存为numpy数组，只在序列化时才构建shape字典。
+    """
+
+    __slots__ = ("xyxy", "scores", "class_ids")
+
+    def __init__(self, xyxy: np.ndarray, scores: np.ndarray, class_ids: np.ndarray):
+        """初始化检测结果
+
+        Args:
+            xyxy: (N, 4) 的边界框数组 [x1, y1, x2, y2]
+            scores: (N,) 的置信度数组
+            class_ids: (N,) 的类别索引数组
+        """
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        """创建空的检测结果"""
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32),
+                   np.zeros(0, np.int64))
+
+    @classmethod
+    def from_result(cls, result) -> "Detections":
+        """从ultralytics推理结果中一次性批量取出检测数据
+
+        Args:
+            result: ultralytics Results 对象
+
+        Returns:
+            检测结果
+        """
+        if isinstance(result, AnnotatedImage):
+            # ONNX Runtime 后端等直接产出 Detections 的结果
+            return result.detections
+        if result.boxes is None or len(result.boxes) == 0:
+            return cls.empty()
+        # boxes.data 每行为 [x1, y1, x2, y2, (track_id,) conf, cls]
+        data = result.boxes.data.cpu().numpy()
+        return cls(data[:, :4], data[:, -2], data[:, -1])
+
+    @classmethod
+    def concatenate(cls, items: List["Detections"]) -> "Detections":
+        """合并多个检测结果"""
+        if not items:
+            return cls.empty()
+        return cls(np.concatenate([d.xyxy for d in items]),
+                   np.concatenate([d.scores for d in items]),
+                   np.concatenate([d.class_ids for d in items]))
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def select(self, index) -> "Detections":
+        """按下标或布尔掩码选取部分检测结果"""
+        return Detections(self.xyxy[index], self.scores[index], self.class_ids[index])
+
+    def scaled(self, scale_x: float, scale_y: float) -> "Detections":
+        """按比例缩放坐标，用于把检测结果映射到尺寸不同的图片"""
+        if scale_x == 1 and scale_y == 1:
+            return self
+        scale = np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        return Detections(self.xyxy * scale, self.scores, self.class_ids)
+
+    def nms(self, iou_threshold: float) -> "Detections":
+        """按类别做NMS，用于合并切片接缝处的重复检测
+
+        Args:
+            iou_threshold: IOU阈值
+
+        Returns:
+            保留下来的检测结果
+        """
+        keep = []
+        for class_id in np.unique(self.class_ids):
+            candidates = np.flatnonzero(self.class_ids == class_id)
+            kept = greedy_nms(self.xyxy[candidates], self.scores[candidates], iou_threshold)
+            keep.append(candidates[kept])
+        if not keep:
+            return self
+        return self.select(np.sort(np.concatenate(keep)))
+
+    def label_names(self, labels: List[str]) -> np.ndarray:
+        """将类别索引映射为标签名，超出范围的索引映射为'unknown'
+
+        Args:
+            labels: 标签列表
+
+        Returns:
+            (N,) 的标签名数组
+        """
+        lookup = np.array(list(labels) + ["unknown"], dtype=object)
+        valid = (self.class_ids >= 0) & (self.class_ids < len(labels))
+        for class_id in np.unique(self.class_ids[~valid]):
+            print(f"Warning: class_id {class_id} out of range, using 'unknown'")
+        return lookup[np.where(valid, self.class_ids, len(labels))]
+
+    def to_points(self) -> np.ndarray:
+        """将所有边界框转换为4个点的坐标
+
+        Returns:
+            (N, 4, 2) 的数组，每个框为 [[x1,y1], [x2,y1], [x2,y2], [x1,y2]]
+        """
+        return self.xyxy[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+
+    def to_shapes(self, labels: List[str]) -> List[dict]:
+        """序列化为X-AnyLabeling的shape字典列表
+
+        Args:
+            labels: 标签列表
+
+        Returns:
+            shape字典列表
+        """
+        names = self.label_names(labels).tolist()
+        scores = self.scores.tolist()
+        points = self.to_points().tolist()
+        return [
+            {
+                "label": label_name,
+                "score": confidence,
+                "points": box_points,
+                "group_id": None,
+                "description": "",
+                "difficult": False,
+                "shape_type": "rectangle",
+                "flags": {},
+                "attributes": {},
+                "kie_linking": []
+            }
+            for label_name, confidence, box_points in zip(names, scores, points)
+        ]
+
+
+def box_iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """计算两组边界框两两之间的IOU矩阵
+
+    与 YOLOInference.calculate_iou 的逐对计算结果一致：
+    没有交集或并集面积为0时IOU为0。
+
+    Args:
+        boxes1: (N, 4) 的边界框数组 [x1, y1, x2, y2]
+        boxes2: (M, 4) 的边界框数组 [x1, y1, x2, y2]
+
+    Returns:
+        (N, M) 的IOU矩阵
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+
+    # 计算交集区域
+    inter_w = (np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+               - np.maximum(boxes1[:, None, 0], boxes2[None, :, 0]))
+    inter_h = (np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+               - np.maximum(boxes1[:, None, 1], boxes2[None, :, 1]))
+    inter_area = inter_w * inter_h
+
+    # 计算并集面积
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    union_area = area1[:, None] + area2[None, :] - inter_area
+
+    valid = (inter_w > 0) & (inter_h > 0) & (union_area != 0)
+    iou = np.zeros(inter_area.shape, dtype=np.float64)
+    np.divide(inter_area, union_area, out=iou, where=valid)
+    return iou
+
+
+def greedy_nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """单类别的贪心NMS
+
+    Args:
+        boxes: (N, 4) 的边界框数组 [x1, y1, x2, y2]
+        scores: (N,) 的置信度数组
+        iou_threshold: IOU大于此值的低分框被抑制
+
+    Returns:
+        保留框的下标数组（按原始顺序）
+    """
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    iou = box_iou_matrix(boxes[order], boxes[order])
+    suppressed = np.zeros(len(order), dtype=bool)
+    for i in range(len(order)):
+        if not suppressed[i]:
+            suppressed[i + 1:] |= iou[i, i + 1:] > iou_threshold
+    return np.sort(order[~suppressed])
+
+
+def weighted_box_fusion(members: List["Detections"], iou_threshold: float = 0.55) -> "Detections":
+    """加权框融合 (WBF)：按类别把各模型中互相重叠的框合并为一个框
+
+    框按置信度从高到低依次加入与其IOU最大且超过阈值的簇，簇的坐标为成员坐标按置信度的加权平均；
+    融合后的置信度为簇内平均置信度乘以 min(簇大小, 模型数) / 模型数，
+    因此只有少数模型检测到的框会被降低置信度。
+
+    Args:
+        members: 每个模型对同一张图片的检测结果
+        iou_threshold: 框加入簇的IOU阈值
+
+    Returns:
+        融合后的检测结果，按置信度从高到低排列
+    """
+    num_models = max(1, len(members))
+    merged = Detections.concatenate(members)
+    if not len(merged):
+        return merged
+
+    fused_xyxy, fused_scores, fused_class_ids = [], [], []
+    for class_id in np.unique(merged.class_ids):
+        candidates = np.flatnonzero(merged.class_ids == class_id)
+        candidates = candidates[np.argsort(-merged.scores[candidates], kind="stable")]
+        boxes = merged.xyxy[candidates].astype(np.float64)
+        scores = merged.scores[candidates].astype(np.float64)
+
+        clusters = np.zeros((0, 4), dtype=np.float64)  # 各簇当前的融合框
+        weighted_sums, score_sums, counts = [], [], []
+        for box, score in zip(boxes, scores):
+            if len(clusters):
+                iou = box_iou_matrix(box[None], clusters)[0]
+                best = int(iou.argmax())
+                if iou[best] > iou_threshold:
+                    weighted_sums[best] += score * box
+                    score_sums[best] += score
+                    counts[best] += 1
+                    clusters[best] = weighted_sums[best] / score_sums[best]
+                    continue
+            weighted_sums.append(score * box)
+            score_sums.append(score)
+            counts.append(1)
+            clusters = np.vstack([clusters, box])
+
+        counts = np.array(counts, dtype=np.float64)
+        fused_xyxy.append(clusters)
+        fused_scores.append(np.array(score_sums) / counts
+                            * np.minimum(counts, num_models) / num_models)
+        fused_class_ids.append(np.full(len(clusters), class_id))
+
+    fused = Detections(np.concatenate(fused_xyxy), np.concatenate(fused_scores),
+                       np.concatenate(fused_class_ids))
+    return fused.select(np.argsort(-fused.scores, kind="stable"))
+
+
+def write_json_atomic(json_path: str, data: dict):
+    """原子地写入JSON文件：先写入同目录下的临时文件，再重命名覆盖
+
+    Args:
+        json_path: 目标JSON文件路径
+        data: 要写入的数据
+    """
+    directory = os.path.dirname(os.path.abspath(json_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".json.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, json_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class AnnotationWriter:
+    """后台线程池写入标注文件，避免文件读写阻塞推理线程
+
+    同一个标注文件的任务总是分配到同一个单线程队列，保证按提交顺序执行；
+    写入失败只记录下来，在运行结束时统一报告。
+    """
+
+    def __init__(self, write_fn, num_workers: int = 2, max_pending: int = 64):
+        """初始化写入器
+
+        Args:
+            write_fn: 写入函数，签名为 write_fn(*args) -> bool，返回是否有检测结果
+            num_workers: 写入线程数
+            max_pending: 最多排队的写入任务数，超过时阻塞以限制内存占用
+        """
+        if num_workers < 1:
+            raise ValueError(f"num_workers must be >= 1, got {num_workers}")
+        self.write_fn = write_fn
+        self.executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"writer{i}")
+                          for i in range(num_workers)]
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.processed_count = 0
+        self.errors = []
+
+    def submit(self, key: str, *args):
+        """提交一个写入任务
+
+        Args:
+            key: 标注文件路径，相同key的任务按提交顺序执行
+            *args: 传给write_fn的参数
+        """
+        self.slots.acquire()
+        executor = self.executors[hash(key) % len(self.executors)]
+        try:
+            executor.submit(self._run, key, args)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _run(self, key: str, args: tuple):
+        try:
+            has_detections = self.write_fn(*args)
+            with self.lock:
+                if has_detections:
+                    self.processed_count += 1
+        except Exception as e:
+            with self.lock:
+                self.errors.append((key, str(e)))
+        finally:
+            self.slots.release()
+
+    def close(self) -> List[Tuple[str, str]]:
+        """等待所有排队的写入完成并关闭线程
+
+        Returns:
+            写入失败的 (文件路径, 错误信息) 列表
+        """
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        return self.errors
+
+
+def annotation_template(image_path: str, width: int, height: int) -> dict:
+    """创建X-AnyLabeling标注文件模板
+
+    Args:
+        image_path: 图片路径
+        width: 图片宽度
+        height: 图片高度
+
+    Returns:
+        标注文件模板字典
+    """
+    return {
+        "version": "2.4.4",
+        "flags": {},
+        "shapes": [],
+        "imagePath": os.path.basename(image_path),
+        "imageData": None,
+        "imageHeight": height,
+        "imageWidth": width
+    }
+
+
+class JsonlDetectionSink:
+    """将一次运行的所有检测结果逐行追加到同一个JSONL文件
+
+    每行是一张图片的记录，检测框、置信度和标签分别按列存放：
+    {"image": ..., "width": W, "height": H, "xyxy": [[x1, y1, x2, y2], ...],
+     "score": [...], "label": [...]}
+    续跑时以追加方式打开，可以继续写入中断前的文件。
+    """
+
+    appendable = True
+
+    def __init__(self, path: str, append: bool = True):
+        """初始化
+
+        Args:
+            path: JSONL文件路径
+            append: 是否追加到已有文件，为False时清空重写
+        """
+        self.path = path
+        # 行缓冲：每条记录写完即落盘，缓存中标记完成的图片不会丢失
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=1)
+
+    def write(self, image: str, image_size: Tuple[int, int], labels: List[str],
+              detections: "Detections"):
+        """写入一张图片的检测结果
+
+        Args:
+            image: 图片路径（相对图片目录）
+            image_size: (width, height)
+            labels: 标签列表
+            detections: 检测结果
+        """
+        record = {
+            "image": image,
+            "width": int(image_size[0]),
+            "height": int(image_size[1]),
+            "xyxy": detections.xyxy.tolist(),
+            "score": detections.scores.tolist(),
+            "label": detections.label_names(labels).tolist(),
+        }
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetDetectionSink:
+    """将一次运行的所有检测结果写入同一个Parquet文件（需要pyarrow）
+
+    列与 JsonlDetectionSink 相同，xyxy/score/label 为列表列。
+    Parquet文件无法追加，每次运行都会重新写入。
+    """
+
+    appendable = False
+
+    def __init__(self, path: str, row_group_size: int = 4096):
+        """初始化
+
+        Args:
+            path: Parquet文件路径
+            row_group_size: 每个行组包含的图片数
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.path = path
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            ("image", pa.string()),
+            ("width", pa.int32()),
+            ("height", pa.int32()),
+            ("xyxy", pa.list_(pa.list_(pa.float32(), 4))),
+            ("score", pa.list_(pa.float32())),
+            ("label", pa.list_(pa.string())),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = {name: [] for name in self.schema.names}
+
+    def write(self, image: str, image_size: Tuple[int, int], labels: List[str],
+              detections: "Detections"):
+        """写入一张图片的检测结果，参数同 JsonlDetectionSink.write"""
+        self.rows["image"].append(image)
+        self.rows["width"].append(int(image_size[0]))
+        self.rows["height"].append(int(image_size[1]))
+        self.rows["xyxy"].append(detections.xyxy.tolist())
+        self.rows["score"].append(detections.scores.tolist())
+        self.rows["label"].append(detections.label_names(labels).tolist())
+        if len(self.rows["image"]) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows["image"]:
+            self.writer.write_table(self.pa.Table.from_pydict(self.rows, schema=self.schema))
+            self.rows = {name: [] for name in self.schema.names}
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def open_detection_sink(path: str, append: bool = False):
+    """按扩展名打开汇总输出文件：.jsonl 或 .parquet
+
+    Args:
+        path: 输出文件路径
+        append: 是否追加到已有的JSONL文件（续跑），Parquet文件总是重新写入
+
+    Returns:
+        JsonlDetectionSink 或 ParquetDetectionSink
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".jsonl":
+        return JsonlDetectionSink(path, append)
+    if extension == ".parquet":
+        return ParquetDetectionSink(path)
+    raise ValueError(f"Unsupported sink format: {path} (expected .jsonl or .parquet)")
+
+
+class YoloTxtExporter:
+    """将检测结果直接写为YOLO格式的训练标签，每张图片一个txt文件
+
+    每行为 "类别索引 x_center y_center width height"（按图片尺寸归一化），
+    类别索引即标签文件中的行号，与 label_converter.py --mode custom2yolo 的输出一致。
+    没有检测的图片也写入空文件，作为训练时的负样本。
+    """
+
+    def __init__(self, output_dir: str):
+        """初始化
+
+        Args:
+            output_dir: txt标签输出目录
+        """
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, image: str, image_size: Tuple[int, int], labels: List[str],
+              detections: "Detections"):
+        """写入一张图片的检测结果，参数同 JsonlDetectionSink.write"""
+        width, height = image_size
+        valid = (detections.class_ids >= 0) & (detections.class_ids < len(labels))
+        xyxy = detections.xyxy[valid].astype(np.float64)
+        xyxy[:, [0, 2]] = np.clip(xyxy[:, [0, 2]] / width, 0.0, 1.0)
+        xyxy[:, [1, 3]] = np.clip(xyxy[:, [1, 3]] / height, 0.0, 1.0)
+        lines = [f"{class_id} {(x1 + x2) / 2:.6f} {(y1 + y2) / 2:.6f} "
+                 f"{x2 - x1:.6f} {y2 - y1:.6f}\n"
+                 for class_id, (x1, y1, x2, y2) in zip(detections.class_ids[valid].tolist(),
+                                                       xyxy.tolist())]
+        txt_path = os.path.join(self.output_dir, Path(image).stem + '.txt')
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+
+    def close(self):
+        pass
+
+
+class CocoExporter:
+    """将检测结果直接写为一个COCO格式的 instances JSON 文件
+
+    类别按标签文件的顺序编号（id 从1开始），与 label_converter.py --mode custom2coco 一致；
+    file_name 为相对图片目录的路径。已有文件时先载入，续跑时之前运行的图片会保留，
+    重新处理的图片替换旧记录。文件在 close() 时一次写出。
+    """
+
+    def __init__(self, path: str, labels: List[str]):
+        """初始化
+
+        Args:
+            path: 输出的JSON文件路径
+            labels: 标签列表
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.images = {}  # file_name -> (image记录, annotation列表)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            annotations = {}
+            for annotation in data.get("annotations", []):
+                annotations.setdefault(annotation["image_id"], []).append(annotation)
+            for image in data.get("images", []):
+                self.images[image["file_name"]] = (image, annotations.get(image["id"], []))
+        self.categories = [{"id": i + 1, "name": name, "supercategory": ""}
+                           for i, name in enumerate(labels)]
+
+    def write(self, image: str, image_size: Tuple[int, int], labels: List[str],
+              detections: "Detections"):
+        """记录一张图片的检测结果，参数同 JsonlDetectionSink.write"""
+        valid = (detections.class_ids >= 0) & (detections.class_ids < len(labels))
+        annotations = []
+        for class_id, (x1, y1, x2, y2) in zip(detections.class_ids[valid].tolist(),
+                                              detections.xyxy[valid].tolist()):
+            width, height = x2 - x1, y2 - y1
+            annotations.append({
+                "category_id": class_id + 1,
+                "bbox": [x1, y1, width, height],
+                "area": width * height,
+                "iscrowd": 0,
+                "ignore": 0,
+                "segmentation": [],
+            })
+        file_name = image.replace(os.sep, "/")
+        record = {
+            "file_name": file_name,
+            "width": int(image_size[0]),
+            "height": int(image_size[1]),
+            "license": 0,
+            "flickr_url": "",
+            "coco_url": "",
+            "date_captured": "",
+        }
+        with self.lock:
+            self.images[file_name] = (record, annotations)
+
+    def close(self):
+        """按文件名顺序重新编号并写出JSON文件"""
+        images, annotations = [], []
+        for image_id, file_name in enumerate(sorted(self.images), 1):
+            record, image_annotations = self.images[file_name]
+            images.append(dict(record, id=image_id))
+            for annotation in image_annotations:
+                annotations.append(dict(annotation, id=len(annotations) + 1, image_id=image_id))
+        write_json_atomic(self.path, {
+            "info": {
+                "description": "YOLOv8 auto-labelling",
+                "date_created": time.strftime("%Y-%m-%d"),
+            },
+            "licenses": [],
+            "categories": self.categories,
+            "images": images,
+            "annotations": annotations,
+        })
+
+
+def iter_sink_records(path: str) -> Iterator[dict]:
+    """逐条读取汇总输出文件中的记录
+
+    JSONL文件末尾因中断而不完整的行会被跳过。
+
+    Args:
+        path: .jsonl 或 .parquet 文件路径
+
+    Yields:
+        包含 image/width/height/xyxy/score/label 的记录字典
+    """
+    if os.path.splitext(path)[1].lower() == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            yield from parquet_file.read_row_group(i).to_pylist()
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line {line_number} in {path}")
+
+
+def expand_detection_sink(sink_path: str, output_dir: str,
+                          iou_threshold: float = 0.85) -> Tuple[int, int]:
+    """将汇总输出文件展开为每张图片一个的X-AnyLabeling标注文件
+
+    同一张图片的多条记录（例如续跑或多次运行）会合并到同一个标注文件；
+    与已有标注文件合并时，和推理时的追加模式一样按标签过滤IOU超过阈值的重复检测。
+
+    Args:
+        sink_path: .jsonl 或 .parquet 文件路径
+        output_dir: 标注文件输出目录
+        iou_threshold: 重复检测的IOU阈值
+
+    Returns:
+        (记录数, 写入的标注文件数)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    record_count = 0
+    written = set()
+    for record in iter_sink_records(sink_path):
+        record_count += 1
+        json_path = merge_sink_record(record, output_dir, iou_threshold)
+        if json_path is not None:
+            written.add(json_path)
+    return record_count, len(written)
+
+
+def filter_sink_record(record: dict, conf_threshold: float) -> dict:
+    """只保留汇总记录中置信度大于阈值的检测
+
+    Args:
+        record: 汇总文件中的一条记录
+        conf_threshold: 置信度阈值（与推理时一样，严格大于阈值的检测保留）
+
+    Returns:
+        过滤后的新记录
+    """
+    keep = np.asarray(record["score"], dtype=np.float32) > conf_threshold
+    return dict(record,
+                xyxy=[box for box, kept in zip(record["xyxy"], keep) if kept],
+                score=[score for score, kept in zip(record["score"], keep) if kept],
+                label=[label for label, kept in zip(record["label"], keep) if kept])
+
+
+def shapes_to_xyxy(shapes: List[dict]) -> np.ndarray:
+    """批量将shapes的points转换为外接矩形数组
+
+    所有类型的shape都按其点的外接矩形参与重复检测过滤。
+
+    Args:
+        shapes: 标注shape列表
+
+    Returns:
+        (N, 4) 的 float64 数组，每行为 [x1, y1, x2, y2]
+    """
+    points = [shape["points"] for shape in shapes]
+    try:
+        points_array = np.asarray(points, dtype=np.float64)
+    except ValueError:
+        # 点数不一致（例如混有多边形标注），逐个转换
+        points_array = None
+    if points_array is not None and points_array.ndim == 3 and points_array.shape[1] > 0:
+        return np.concatenate([points_array.min(axis=1), points_array.max(axis=1)], axis=1)
+    bboxes = []
+    for shape_points in points:
+        shape_points = np.asarray(shape_points, dtype=np.float64).reshape(-1, 2)
+        bboxes.append(np.concatenate([shape_points.min(axis=0), shape_points.max(axis=0)]))
+    return np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+
+
+def merge_sink_record(record: dict, output_dir: str,
+                      iou_threshold: float = 0.85) -> Optional[str]:
+    """将一条汇总记录合并到对应图片的X-AnyLabeling标注文件
+
+    Args:
+        record: 汇总文件中的一条记录
+        output_dir: 标注文件输出目录
+        iou_threshold: 重复检测的IOU阈值
+
+    Returns:
+        写入的标注文件路径，没有需要追加的检测时返回None
+    """
+    # 与 YOLOInference.get_json_path 的命名规则一致
+    json_path = os.path.join(output_dir, Path(record["image"]).stem + '.json')
+    if os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            annotation_data = json.load(f)
+    else:
+        annotation_data = annotation_template(record["image"], record["width"],
+                                              record["height"])
+
+    xyxy = np.asarray(record["xyxy"], dtype=np.float32).reshape(-1, 4)
+    keep = np.ones(len(xyxy), dtype=bool)
+    # 与 YOLOInference.filter_duplicate_detections 一样，和所有已有标注比较
+    existing = annotation_data["shapes"]
+    if existing:
+        existing_xyxy = shapes_to_xyxy(existing)
+        existing_labels = np.array([shape["label"] for shape in existing], dtype=object)
+        labels = np.array(record["label"], dtype=object)
+        for label in dict.fromkeys(record["label"]):
+            new_idx = np.flatnonzero(labels == label)
+            existing_idx = np.flatnonzero(existing_labels == label)
+            if len(existing_idx):
+                iou = box_iou_matrix(xyxy[new_idx].astype(np.float64),
+                                     existing_xyxy[existing_idx])
+                keep[new_idx[(iou > iou_threshold).any(axis=1)]] = False
+
+    if not keep.any():
+        return None
+    # 记录中保存的是标签名，以每个检测自己的标签名作为"标签列表"构造shape
+    label_names = [label for label, kept in zip(record["label"], keep) if kept]
+    detections = Detections(xyxy[keep], np.asarray(record["score"])[keep],
+                            np.arange(len(label_names)))
+    annotation_data["shapes"].extend(detections.to_shapes(label_names))
+    write_json_atomic(json_path, annotation_data)
+    return json_path
+
+
+def hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """计算文件内容的哈希值
+
+    Args:
+        file_path: 文件路径
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        十六进制哈希字符串
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with file_path.open() if isinstance(file_path, ArchiveMember) else open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """基于SQLite的推理结果清单
+
+    detections 表按 图片内容哈希 + 模型哈希 + 置信度阈值 缓存原始检测结果（数组形式）；
+    completed 表按 输出目标（标注文件路径或汇总记录名）+ 图片内容哈希 记录已经写出的结果，
+    内容相同但路径不同的图片各自输出。中断后重新运行时，已完成的图片直接跳过；
+    只有检测缓存的图片（例如输出格式变了）直接复用缓存结果，无需再次推理。
+    """
+
+    FILENAME = ".inference_cache.sqlite"
+
+    def __init__(self, db_path: str, model_hash: str, commit_interval: int = 100):
+        """打开（或创建）缓存数据库
+
+        Args:
+            db_path: SQLite数据库文件路径
+            model_hash: 模型文件哈希
+            commit_interval: 每累计多少次写入提交一次事务
+        """
+        self.db_path = db_path
+        self.model_hash = model_hash
+        self.commit_interval = commit_interval
+        self.uncommitted = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+                image_hash TEXT NOT NULL,
+                model_hash TEXT NOT NULL,
+                conf REAL NOT NULL,
+                xyxy BLOB NOT NULL,
+                scores BLOB NOT NULL,
+                class_ids BLOB NOT NULL,
+                PRIMARY KEY (image_hash, model_hash, conf)
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS completed (
+                target TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                model_hash TEXT NOT NULL,
+                conf REAL NOT NULL,
+                output TEXT NOT NULL,
+                image_path TEXT,
+                PRIMARY KEY (target, image_hash, model_hash, conf, output)
+            )""")
+        self.conn.commit()
+
+    def get_detections(self, image_hash: str, conf: float) -> Optional[Detections]:
+        """查询缓存的检测结果
+
+        Args:
+            image_hash: 图片内容哈希
+            conf: 置信度阈值
+
+        Returns:
+            缓存的检测结果，不存在时返回None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT xyxy, scores, class_ids FROM detections "
+                "WHERE image_hash=? AND model_hash=? AND conf=?",
+                (image_hash, self.model_hash, conf)).fetchone()
+        if row is None:
+            return None
+        xyxy, scores, class_ids = row
+        return Detections(np.frombuffer(xyxy, dtype=np.float32),
+                          np.frombuffer(scores, dtype=np.float32),
+                          np.frombuffer(class_ids, dtype=np.int64))
+
+    def put_detections(self, image_hash: str, conf: float, detections: Detections):
+        """缓存检测结果
+
+        Args:
+            image_hash: 图片内容哈希
+            conf: 置信度阈值
+            detections: 检测结果
+        """
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?, ?)",
+                (image_hash, self.model_hash, conf, detections.xyxy.tobytes(),
+                 detections.scores.tobytes(), detections.class_ids.tobytes()))
+            self._maybe_commit()
+
+    def is_completed(self, target: str, image_hash: str, conf: float, output: str) -> bool:
+        """查询该内容的图片是否已经写出过指定目标和格式的结果
+
+        Args:
+            target: 输出目标，标注文件路径或汇总记录中的图片名
+            image_hash: 图片内容哈希
+            conf: 置信度阈值
+            output: 输出格式及位置
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM completed WHERE target=? AND image_hash=? "
+                "AND model_hash=? AND conf=? AND output=?",
+                (target, image_hash, self.model_hash, conf, output)).fetchone()
+        return row is not None
+
+    def mark_completed(self, target: str, image_hash: str, conf: float, output: str,
+                       image_path: str):
+        """记录图片已经写出指定目标和格式的结果，参数同 is_completed"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completed VALUES (?, ?, ?, ?, ?, ?)",
+                (target, image_hash, self.model_hash, conf, output, image_path))
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_interval:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        """提交未完成的事务并关闭数据库"""
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class BKTree:
+    """按汉明距离索引整数哈希的BK树，支持查找阈值内最近的哈希"""
+
+    def __init__(self):
+        # 节点为 [哈希, 值, {距离: 子节点}]
+        self.root = None
+        self.size = 0
+
+    def add(self, key: int, value):
+        """插入一个哈希及其关联的值"""
+        self.size += 1
+        if self.root is None:
+            self.root = [key, value, {}]
+            return
+        node = self.root
+        while True:
+            distance = bin(key ^ node[0]).count("1")
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def nearest(self, key: int, max_distance: int) -> Optional[Tuple[int, object]]:
+        """查找汉明距离不超过 max_distance 的最近哈希
+
+        Returns:
+            (距离, 值)，没有时返回None
+        """
+        best = None
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = bin(key ^ node[0]).count("1")
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, node[1])
+                if distance == 0:
+                    break
+            # 三角不等式：只有边距离在 [d - r, d + r] 内的子树可能包含结果
+            radius = max_distance if best is None else best[0]
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return best
+
+
+class NearDuplicateIndex:
+    """推理前按感知哈希查找近似重复的图片，复用已推理图片的检测结果
+
+    每张图片先计算dHash并在BK树中查找汉明距离阈值内最近的已推理图片：
+    找到时不再推理，等参考图片的检测结果出来后按两者尺寸缩放坐标复用；
+    否则作为新的参考图片加入索引并正常推理。
+    """
+
+    def __init__(self, max_distance: int = 4):
+        """初始化
+
+        Args:
+            max_distance: 视为近似重复的最大汉明距离（64位哈希）
+        """
+        self.max_distance = max_distance
+        self.tree = BKTree()
+        self.sizes = {}       # 参考图片 -> (width, height)
+        self.detections = {}  # 参考图片 -> Detections，推理失败为None
+        self.pending = {}     # 参考图片 -> 等待其结果的 [(图片, 尺寸)]
+        self.ready = deque()
+        self.decisions = []   # (图片, 参考图片, 距离)
+
+    def add(self, image_path: str, detections: Optional["Detections"] = None) -> bool:
+        """登记一张图片
+
+        Args:
+            image_path: 图片路径
+            detections: 已知的检测结果（例如来自缓存），提供时直接作为参考图片
+
+        Returns:
+            True 表示是近似重复的图片，不需要推理，结果稍后由 pop_ready 产出
+        """
+        key, size = perceptual_hash(image_path)
+        # 只保留路径字符串，不引用压缩包图片的内存数据
+        image_path = str(image_path)
+        match = self.tree.nearest(key, self.max_distance) if detections is None else None
+        if match is not None:
+            distance, reference = match
+            self.decisions.append((image_path, reference, distance))
+            if reference in self.detections:
+                self.ready.append((image_path, reference, size))
+            else:
+                self.pending.setdefault(reference, []).append((image_path, size))
+            return True
+
+        self.tree.add(key, image_path)
+        self.sizes[image_path] = size
+        if detections is not None:
+            self.detections[image_path] = detections
+        return False
+
+    def set_detections(self, image_path: str, detections: Optional["Detections"]):
+        """记录参考图片的检测结果，None 表示推理失败"""
+        if image_path not in self.sizes:
+            return
+        self.detections[image_path] = detections
+        for duplicate, size in self.pending.pop(image_path, []):
+            self.ready.append((duplicate, image_path, size))
+
+    def pop_ready(self) -> Iterator[Tuple[str, str, Optional["Detections"], Tuple[int, int]]]:
+        """产出参考结果已就绪的近似重复图片
+
+        Yields:
+            (图片路径, 参考图片路径, 缩放到该图片尺寸的检测结果或None, (width, height))
+        """
+        while self.ready:
+            image_path, reference, size = self.ready.popleft()
+            detections = self.detections[reference]
+            if detections is not None:
+                ref_width, ref_height = self.sizes[reference]
+                detections = detections.scaled(size[0] / ref_width, size[1] / ref_height)
+            yield image_path, reference, detections, size
+
+    def unresolved(self) -> List[str]:
+        """参考图片没有产出结果（例如被跳过）的近似重复图片"""
+        return [image_path for duplicates in self.pending.values()
+                for image_path, _ in duplicates]
+
+
+class LetterboxedImage:
+    """完成 letterbox 预处理的图片，OnnxYOLO 可直接对其推理，无需再次解码和缩放"""
+
+    def __init__(self, canvas: np.ndarray, gain: float, pad: Tuple[int, int],
+                 orig_shape: Tuple[int, int], image: Optional[np.ndarray] = None,
+                 image_path: Optional[str] = None):
+        """初始化
+
+        Args:
+            canvas: imgsz x imgsz x 3 的 uint8 RGB 画布（可以是缓存文件的内存映射视图）
+            gain: 缩放比例
+            pad: (左侧填充, 顶部填充)
+            orig_shape: 原图 (高, 宽)
+            image: 原图BGR数组，从缓存读取时为None
+            image_path: 图片路径，渲染结果图片时用于重新解码
+        """
+        self.canvas = canvas
+        self.gain = gain
+        self.pad = pad
+        self.orig_shape = orig_shape
+        self.image = image
+        self.image_path = image_path
+
+
+class TensorCache:
+    """letterbox 后的 uint8 图片张量缓存，每张图片一个内存映射文件，跨运行复用
+
+    每张图片的 imgsz x imgsz x 3 画布保存为 <目录>/letterbox_<imgsz>/<哈希前两位>/<哈希>.u8，
+    先写入临时文件再原子重命名，读取时只会看到完整的文件；SQLite索引记录
+    图片内容哈希 -> letterbox 参数和最近使用时间，超过容量时淘汰最久未使用的图片。
+    多个进程可以共用同一个缓存目录：文件缺失或不完整（例如刚被其他进程淘汰）时
+    视为未命中，重新计算。读取返回只读的内存映射视图，不解码也不复制，
+    文件被淘汰后已经取得的视图仍然有效。
+    """
+
+    def __init__(self, cache_dir: str, imgsz: int, max_bytes: int,
+                 commit_interval: int = 100, evict_interval: int = 64):
+        """打开（或创建）缓存
+
+        Args:
+            cache_dir: 缓存目录，每个输入尺寸使用独立的子目录和索引
+            imgsz: letterbox 输入尺寸
+            max_bytes: 缓存文件总大小上限（字节）
+            commit_interval: 最近使用时间每累计多少次更新写回一次索引
+            evict_interval: 每写入多少张图片重新统计一次数量（包括其他进程写入的），
+                超过容量时淘汰
+        """
+        self.imgsz = imgsz
+        self.slot_shape = (imgsz, imgsz, 3)
+        self.slot_bytes = imgsz * imgsz * 3
+        self.capacity = max_bytes // self.slot_bytes
+        if self.capacity < 1:
+            raise ValueError(f"Tensor cache size must hold at least one {imgsz}x{imgsz} image "
+                             f"({self.slot_bytes} bytes)")
+        self.commit_interval = commit_interval
+        self.evict_interval = evict_interval
+        self.known_count = 0
+        self.puts_since_evict = 0
+        self.touched = {}  # 图片哈希 -> 尚未写回索引的最近使用时间
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.data_dir = os.path.join(cache_dir, f"letterbox_{imgsz}")
+        os.makedirs(self.data_dir, exist_ok=True)
+        # 多个进程共用索引时，等待其他进程的写事务而不是立即报错
+        self.conn = sqlite3.connect(os.path.join(self.data_dir, "index.sqlite"),
+                                    timeout=60, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                image_hash TEXT PRIMARY KEY,
+                gain REAL NOT NULL,
+                pad_x INTEGER NOT NULL,
+                pad_y INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        # 容量变小时立即淘汰超出的图片
+        with self.lock:
+            self._evict()
+
+    @property
+    def count(self) -> int:
+        """当前缓存的图片数量"""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _path(self, image_hash: str) -> str:
+        return os.path.join(self.data_dir, image_hash[:2], image_hash + ".u8")
+
+    def get(self, image_hash: str) -> Optional[LetterboxedImage]:
+        """读取缓存的 letterbox 结果
+
+        Args:
+            image_hash: 图片文件内容哈希
+
+        Returns:
+            画布为只读内存映射视图的 LetterboxedImage，未缓存或文件不可用时返回None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT gain, pad_x, pad_y, height, width FROM entries "
+                "WHERE image_hash=?", (image_hash,)).fetchone()
+        if row is not None:
+            try:
+                canvas = np.memmap(self._path(image_hash), dtype=np.uint8, mode="r",
+                                   shape=self.slot_shape)
+            except (OSError, ValueError):
+                # 文件已被其他进程淘汰，或者不完整：当作未命中，由调用方重新计算并写入
+                canvas = None
+        if row is None or canvas is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.touched[image_hash] = time.time()
+            if len(self.touched) >= self.commit_interval:
+                self._write_touched()
+        gain, pad_x, pad_y, height, width = row
+        return LetterboxedImage(canvas, gain, (pad_x, pad_y), (height, width))
+
+    def put(self, image_hash: str, letterboxed: LetterboxedImage):
+        """写入一张图片的 letterbox 结果，超过容量时淘汰最久未使用的图片
+
+        Args:
+            image_hash: 图片文件内容哈希
+            letterboxed: letterbox 结果
+        """
+        path = self._path(image_hash)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # 先完整写入文件再登记索引，索引中的记录不会指向写了一半的数据；
+        # 文件以内容哈希命名，其他进程同时写入同一张图片时内容相同，谁覆盖都可以
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".u8.tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(np.ascontiguousarray(letterboxed.canvas, dtype=np.uint8).tobytes())
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # Windows 上目标文件正被映射时无法覆盖，已有的完整文件内容相同，直接使用
+                os.remove(tmp_path)
+                if os.path.getsize(path) != self.slot_bytes:
+                    raise
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        height, width = letterboxed.orig_shape
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_hash, letterboxed.gain, letterboxed.pad[0], letterboxed.pad[1],
+                 height, width, time.time()))
+            self.known_count += 1
+            self.puts_since_evict += 1
+            if self.known_count > self.capacity or self.puts_since_evict >= self.evict_interval:
+                self._evict()
+
+    def _evict(self):
+        """淘汰超出容量的最久未使用的图片：先删除索引记录，再删除文件"""
+        with self._transaction():
+            count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            evicted = [row[0] for row in self.conn.execute(
+                "SELECT image_hash FROM entries ORDER BY last_used LIMIT ?",
+                (max(0, count - self.capacity),))]
+            self.conn.executemany("DELETE FROM entries WHERE image_hash=?",
+                                  [(image_hash,) for image_hash in evicted])
+        self.known_count = count - len(evicted)
+        self.puts_since_evict = 0
+        for image_hash in evicted:
+            self.touched.pop(image_hash, None)
+            try:
+                os.remove(self._path(image_hash))
+            except OSError:
+                # 已被其他进程删除，或在 Windows 上仍被映射
+                pass
+
+    def _write_touched(self):
+        """把累计的最近使用时间一次写回索引（只更新仍存在的记录）"""
+        if self.touched:
+            with self._transaction():
+                self.conn.executemany("UPDATE entries SET last_used=? WHERE image_hash=?",
+                                      [(used, image_hash)
+                                       for image_hash, used in self.touched.items()])
+            self.touched = {}
+
+    @contextmanager
+    def _transaction(self):
+        """立即获取写锁的事务，与共用索引的其他进程串行执行"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def flush(self):
+        """把累计的最近使用时间写回索引"""
+        with self.lock:
+            self._write_touched()
+
+    def close(self):
+        """写回最近使用时间并关闭缓存"""
+        with self.lock:
+            self._write_touched()
+            self.conn.close()
+
+
+class OnnxYOLO:
+    """使用ONNX Runtime在CPU上运行导出的YOLOv8检测模型
+
+    调用方式与 ultralytics YOLO 对象相同：model(sources, conf=...) 返回逐图的结果，
+    结果为 AnnotatedImage，可直接用 Detections.from_result 取出检测数据。
+    letterbox 预处理和NMS后处理全部用NumPy实现。
+    """
+
+    def __init__(self, onnx_path: str, imgsz: int = 640, iou_threshold: float = 0.7,
+                 max_det: int = 300, num_threads: int = 0):
+        """加载ONNX模型
+
+        Args:
+            onnx_path: ONNX模型文件路径
+            imgsz: 输入尺寸，模型输入尺寸固定时以模型为准
+            iou_threshold: NMS的IOU阈值
+            max_det: 每张图片最多保留的检测数量
+            num_threads: ONNX Runtime 线程数，0表示由ONNX Runtime决定
+        """
+        self.tensor_cache = None
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("请安装onnxruntime: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options,
+                                            providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # 动态输入时各维度为字符串
+        if isinstance(model_input.shape[2], int):
+            imgsz = model_input.shape[2]
+        self.imgsz = imgsz
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+
+    @staticmethod
+    def export(model_path: str, imgsz: int = 640, model_hash: Optional[str] = None) -> str:
+        """将 .pt 模型导出为ONNX，并以权重哈希和输入尺寸为键缓存在模型旁边
+
+        Args:
+            model_path: .pt 模型文件路径
+            imgsz: 导出的输入尺寸
+            model_hash: 模型文件哈希，为None时自动计算
+
+        Returns:
+            ONNX模型文件路径
+        """
+        if model_hash is None:
+            model_hash = hash_file(model_path)
+        stem = os.path.splitext(model_path)[0]
+        onnx_path = f"{stem}.{model_hash[:12]}.{imgsz}.onnx"
+        if os.path.exists(onnx_path):
+            return onnx_path
+
+        print(f"Exporting {model_path} to ONNX (imgsz={imgsz})...")
+        exported = import_yolo()(model_path).export(format="onnx", imgsz=imgsz, dynamic=True)
+        os.replace(exported, onnx_path)
+        print(f"Cached ONNX model: {onnx_path}")
+        return onnx_path
+
+    def letterbox(self, image: np.ndarray) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+        """等比例缩放并居中填充到 imgsz x imgsz
+
+        Args:
+            image: HxWx3 的 BGR 图片数组
+
+        Returns:
+            (3 x imgsz x imgsz 的 float32 RGB 数组, 缩放比例, (左侧填充, 顶部填充))
+        """
+        letterboxed = self.letterbox_uint8(image)
+        tensor = letterboxed.canvas.transpose(2, 0, 1).astype(np.float32) / 255.0
+        return tensor, letterboxed.gain, letterboxed.pad
+
+    def letterbox_uint8(self, image: np.ndarray) -> LetterboxedImage:
+        """等比例缩放并居中填充到 imgsz x imgsz，保留 uint8 RGB 画布
+
+        Args:
+            image: HxWx3 的 BGR 图片数组
+
+        Returns:
+            LetterboxedImage
+        """
+        height, width = image.shape[:2]
+        gain = min(self.imgsz / height, self.imgsz / width)
+        new_width, new_height = int(round(width * gain)), int(round(height * gain))
+        pad_x, pad_y = (self.imgsz - new_width) / 2, (self.imgsz - new_height) / 2
+        left, top = int(round(pad_x - 0.1)), int(round(pad_y - 0.1))
+
+        rgb = Image.fromarray(np.ascontiguousarray(image[:, :, ::-1]))
+        if (new_width, new_height) != (width, height):
+            rgb = rgb.resize((new_width, new_height), Image.BILINEAR)
+        canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        canvas[top:top + new_height, left:left + new_width] = np.asarray(rgb)
+        return LetterboxedImage(canvas, gain, (left, top), (height, width), image)
+
+    def load(self, image_path: str,
+             image_hash: Optional[str] = None) -> Union[LetterboxedImage, np.ndarray]:
+        """读取一张图片；有张量缓存时返回 letterbox 结果，缓存命中时跳过解码
+
+        Args:
+            image_path: 图片路径
+            image_hash: 图片文件内容哈希，为None时自动计算
+
+        Returns:
+            LetterboxedImage，没有张量缓存时为解码后的BGR数组
+        """
+        if self.tensor_cache is None:
+            return decode_image(image_path)
+        if image_hash is None:
+            image_hash = hash_file(image_path)
+        letterboxed = self.tensor_cache.get(image_hash)
+        if letterboxed is None:
+            letterboxed = self.letterbox_uint8(decode_image(image_path))
+            self.tensor_cache.put(image_hash, letterboxed)
+        letterboxed.image_path = image_path
+        return letterboxed
+
+    def postprocess(self, prediction: np.ndarray, gain: float, pad: Tuple[float, float],
+                    orig_shape: Tuple[int, int], conf_threshold: float) -> Detections:
+        """解码单张图片的模型输出，过滤低置信度、做NMS并还原到原图坐标
+
+        Args:
+            prediction: (4 + 类别数, 候选数) 的模型输出
+            gain: letterbox 缩放比例
+            pad: letterbox 的 (左侧填充, 顶部填充)
+            orig_shape: 原图 (高, 宽)
+            conf_threshold: 置信度阈值
+
+        Returns:
+            检测结果
+        """
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        mask = scores > conf_threshold
+        if not mask.any():
+            return Detections.empty()
+
+        boxes = prediction[mask, :4]
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+        detections = Detections(xyxy, scores[mask], class_ids[mask]).nms(self.iou_threshold)
+        if len(detections) > self.max_det:
+            detections = detections.select(np.argsort(-detections.scores,
+                                                      kind="stable")[:self.max_det])
+
+        # 还原到原图坐标
+        detections.xyxy -= np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)
+        detections.xyxy /= gain
+        height, width = orig_shape
+        detections.xyxy[:, [0, 2]] = np.clip(detections.xyxy[:, [0, 2]], 0, width)
+        detections.xyxy[:, [1, 3]] = np.clip(detections.xyxy[:, [1, 3]], 0, height)
+        return detections
+
+    def __call__(self, source, conf: float = 0.25, **kwargs) -> List[AnnotatedImage]:
+        """对图片路径或BGR数组（单个或列表）进行推理
+
+        Args:
+            source: 图片路径、BGR数组、LetterboxedImage 或它们的列表
+            conf: 置信度阈值
+
+        Returns:
+            逐图的 AnnotatedImage 列表
+        """
+        sources = source if isinstance(source, list) else [source]
+        items = [self.load(item) if isinstance(item, str) else item for item in sources]
+        if not items:
+            return []
+
+        start = time.perf_counter()
+        letterboxed = [item if isinstance(item, LetterboxedImage) else self.letterbox_uint8(item)
+                       for item in items]
+        # 画布可能是缓存文件的内存映射视图，在这里一次性转换为模型输入
+        batch = np.stack([item.canvas for item in letterboxed]).transpose(0, 3, 1, 2)
+        batch = batch.astype(np.float32) / 255.0
+        preprocessed = time.perf_counter()
+        output = self.session.run(None, {self.input_name: batch})[0]
+        forwarded = time.perf_counter()
+
+        labels = [self.names[i] for i in sorted(self.names)] if self.names else []
+        results = []
+        for item, prediction in zip(letterboxed, output):
+            detections = self.postprocess(prediction, item.gain, item.pad, item.orig_shape, conf)
+            results.append(AnnotatedImage(item.image, detections, labels,
+                                          orig_shape=item.orig_shape, image_path=item.image_path))
+
+        # 与 ultralytics Results.speed 一样记录每张图片的平均耗时（毫秒）
+        speed = {
+            "preprocess": (preprocessed - start) * 1000.0 / len(items),
+            "inference": (forwarded - preprocessed) * 1000.0 / len(items),
+            "postprocess": (time.perf_counter() - forwarded) * 1000.0 / len(items),
+        }
+        for result in results:
+            result.speed = speed
+        return results
+
+
+class EnsembleModel:
+    """多个模型的集成，调用方式与 ultralytics YOLO 对象相同
+
+    每批图片只解码一次，所有模型在同一批图片数组上推理；各模型的类别按标签名映射到
+    统一的标签列表（按各标签文件中首次出现的顺序合并），再用WBF或NMS融合为一份结果。
+    """
+
+    def __init__(self, models: list, labels: List[List[str]], fusion: str = "wbf",
+                 iou_threshold: float = 0.55):
+        """初始化
+
+        Args:
+            models: 已加载的模型（ultralytics YOLO 或 OnnxYOLO）
+            labels: 与 models 一一对应的标签列表
+            fusion: 融合方式，"wbf" 或 "nms"
+            iou_threshold: 融合的IOU阈值
+        """
+        if fusion not in ("wbf", "nms"):
+            raise ValueError(f"Unknown fusion method: {fusion}")
+        self.models = models
+        self.fusion = fusion
+        self.iou_threshold = iou_threshold
+        self.labels = []
+        for member_labels in labels:
+            self.labels.extend(name for name in member_labels if name not in self.labels)
+        index = {name: i for i, name in enumerate(self.labels)}
+        # 各模型的类别索引 -> 统一标签列表中的索引
+        self.class_maps = [np.array([index[name] for name in member_labels], dtype=np.int64)
+                           for member_labels in labels]
+
+    @staticmethod
+    def remap(detections: "Detections", class_map: np.ndarray) -> "Detections":
+        """把类别索引映射到统一的标签列表，超出标签文件范围的索引映射为-1（unknown）"""
+        valid = (detections.class_ids >= 0) & (detections.class_ids < len(class_map))
+        class_ids = np.full(len(detections), -1, dtype=np.int64)
+        class_ids[valid] = class_map[detections.class_ids[valid]]
+        return Detections(detections.xyxy, detections.scores, class_ids)
+
+    def __call__(self, source, conf: float = 0.25, **kwargs) -> List[AnnotatedImage]:
+        """对图片路径或BGR数组（单个或列表）进行集成推理
+
+        Args:
+            source: 图片路径、BGR数组或它们的列表
+            conf: 置信度阈值，同时用于各模型的输出和融合后的结果
+
+        Returns:
+            逐图的 AnnotatedImage 列表
+        """
+        sources = source if isinstance(source, list) else [source]
+        images = [decode_image(item) if isinstance(item, str) else item for item in sources]
+        if not images:
+            return []
+
+        member_detections = []
+        for model, class_map in zip(self.models, self.class_maps):
+            results = model(images, conf=conf)
+            member_detections.append([self.remap(Detections.from_result(result), class_map)
+                                      for result in results])
+
+        results = []
+        for i, image in enumerate(images):
+            members = [detections[i] for detections in member_detections]
+            if self.fusion == "wbf":
+                fused = weighted_box_fusion(members, self.iou_threshold)
+                fused = fused.select(fused.scores > conf)
+            else:
+                fused = Detections.concatenate(members).nms(self.iou_threshold)
+            results.append(AnnotatedImage(image, fused, self.labels))
+        return results
 
 
 class YOLOInference:
-    def __init__(self, model_path: str, labels_file: str):
+    def __init__(self, model_path: str, labels_file: str, backend: str = "ultralytics",
+                 imgsz: int = 640, num_threads: int = 0, quiet: bool = False,
+                 timer: Optional[StageTimer] = None,
+                 ensemble: Optional[List[Tuple[str, str]]] = None,
+                 fusion: str = "wbf", fusion_iou: float = 0.55,
+                 tensor_cache: Optional[str] = None, tensor_cache_size: int = 10 * 1024 ** 3):
         """初始化YOLO推理器
 
         Args:
-            model_path: YOLO模型文件路径 (.pt)
+            model_path: YOLO模型文件路径 (.pt，onnxruntime 后端也可直接使用 .onnx)
             labels_file: 标签文件路径 (labels.txt)
+            backend: 推理后端，"ultralytics" 或 "onnxruntime"
+            imgsz: onnxruntime 后端导出和推理使用的输入尺寸
+            num_threads: onnxruntime 后端的线程数，0表示由ONNX Runtime决定
+            quiet: 不打印逐图片的处理信息，只保留错误和汇总
+            timer: 分阶段计时器，为None时不计时
+            ensemble: 与主模型一起集成推理的其他模型，每项为 (模型路径, 标签文件路径)
+            fusion: 集成结果的融合方式，"wbf"（加权框融合）或 "nms"
+            fusion_iou: 融合的IOU阈值
+            tensor_cache: letterbox 张量缓存目录（仅 onnxruntime 后端），为None时不缓存
+            tensor_cache_size: 张量缓存文件的总大小上限（字节）
         """
-        self.model = YOLO(model_path)
+        self._init_state(model_path, labels_file, backend, imgsz, quiet, timer,
+                         ensemble, fusion, fusion_iou)
+        self.model = self._load_model(model_path, num_threads)
         self.labels = self.load_labels(labels_file)
-        print(f"Loaded model: {model_path}")
+        print(f"Loaded model: {model_path} (backend: {backend})")
         print(f"Loaded {len(self.labels)} labels: {self.labels}")
 
+        if self.ensemble:
+            models, labels = [self.model], [self.labels]
+            for member_path, member_labels_file in self.ensemble:
+                models.append(self._load_model(member_path, num_threads))
+                labels.append(self.load_labels(member_labels_file))
+                print(f"Loaded ensemble model: {member_path} ({len(labels[-1])} labels)")
+            self.model = EnsembleModel(models, labels, fusion, fusion_iou)
+            self.labels = self.model.labels
+            print(f"Ensemble of {len(models)} models ({fusion} fusion), "
+                  f"{len(self.labels)} merged labels: {self.labels}")
+
+        if tensor_cache is not None:
+            if backend != "onnxruntime" or self.ensemble:
+                raise ValueError("The tensor cache requires the onnxruntime backend "
+                                 "and cannot be used with an ensemble")
+            self.tensor_cache = TensorCache(tensor_cache, self.model.imgsz, tensor_cache_size)
+            self.model.tensor_cache = self.tensor_cache
+            print(f"Tensor cache: {tensor_cache} ({self.tensor_cache.count} of "
+                  f"{self.tensor_cache.capacity} images cached)")
+
+    @classmethod
+    def from_model(cls, model, labels: List[str], model_path: Optional[str] = None,
+                   backend: str = "custom", imgsz: int = 640, quiet: bool = False,
+                   timer: Optional[StageTimer] = None) -> "YOLOInference":
+        """用已经加载的模型构造推理器，不读取模型和标签文件
+
+        适用于基准测试等自行提供模型对象的场景。
+
+        Args:
+            model: 可按 model(images, conf=...) 调用的模型，只用到过滤等逻辑时可以为None
+            labels: 标签列表
+            model_path: 模型文件路径，用于检测结果缓存的索引，为None时不能使用缓存
+            backend: 后端名称，非 "ultralytics" 时会计入缓存索引
+            imgsz: 输入尺寸
+            quiet: 不打印逐图片的处理信息
+            timer: 分阶段计时器，为None时不计时
+
+        Returns:
+            YOLOInference 实例
+        """
+        inference = cls.__new__(cls)
+        inference._init_state(model_path, None, backend, imgsz, quiet, timer)
+        inference.model = model
+        inference.labels = list(labels)
+        return inference
+
+    def _init_state(self, model_path: Optional[str], labels_file: Optional[str], backend: str,
+                    imgsz: int, quiet: bool, timer: Optional[StageTimer],
+                    ensemble: Optional[List[Tuple[str, str]]] = None,
+                    fusion: str = "wbf", fusion_iou: float = 0.55):
+        """设置与模型加载无关的属性，参数同 __init__"""
+        self.model_path = model_path
+        self.labels_file = labels_file
+        self.backend = backend
+        self.imgsz = imgsz
+        self.quiet = quiet
+        self.timer = timer or StageTimer()
+        self.ensemble = list(ensemble or [])
+        self.fusion = fusion
+        self.fusion_iou = fusion_iou
+        self.tensor_cache = None
+        self._model_hash = None
+
+    def _load_model(self, model_path: str, num_threads: int = 0):
+        """按推理后端加载一个模型
+
+        Args:
+            model_path: 模型文件路径
+            num_threads: onnxruntime 后端的线程数
+
+        Returns:
+            可按 model(images, conf=...) 调用的模型
+        """
+        if self.backend == "ultralytics":
+            return import_yolo()(model_path)
+        if self.backend == "onnxruntime":
+            onnx_path = model_path if model_path.endswith(".onnx") else \
+                OnnxYOLO.export(model_path, self.imgsz,
+                                self.model_hash if model_path == self.model_path else None)
+            return OnnxYOLO(onnx_path, self.imgsz, num_threads=num_threads)
+        raise ValueError(f"Unknown backend: {self.backend}")
+
+    @property
+    def model_hash(self) -> str:
+        """模型文件内容哈希，用于检测结果缓存的索引"""
+        if self._model_hash is None:
+            self._model_hash = hash_file(self.model_path)
+        return self._model_hash
+
+    def log(self, message: str):
+        """打印逐图片的处理信息，quiet模式下不输出"""
+        if not self.quiet:
+            print(message)
+
     def load_labels(self, labels_file: str) -> List[str]:
         """加载标签文件
 
@@ -48,7 +2252,9 @@ class YOLOInference:
         return labels
 
     def get_image_info(self, image_path: str) -> Tuple[int, int]:
-        """获取图片尺寸
+        """获取图片尺寸，只解析文件头，并缓存在图片目录的尺寸索引中（压缩包中的图片从内存数据读取）
+
+        尺寸按EXIF方向转换，与 decode_image 解码后的图片以及推理结果的 orig_shape 一致。
 
         Args:
             image_path: 图片路径
@@ -56,29 +2262,25 @@ class YOLOInference:
         Returns:
             (width, height)
         """
-        with Image.open(image_path) as img:
-            return img.size  # (width, height)
+        if isinstance(image_path, ArchiveMember):
+            return image_header.read_image_size_or_decode(image_path.open(), exif_transpose=True)
+        return image_header.get_image_size(image_path, exif_transpose=True)
 
-    def create_annotation_template(self, image_path: str) -> dict:
+    def create_annotation_template(self, image_path: str,
+                                   image_size: Optional[Tuple[int, int]] = None) -> dict:
         """创建标注文件模板
 
         Args:
             image_path: 图片路径
+            image_size: 已知的 (width, height)，为None时读取图片获取
 
         Returns:
             标注文件模板字典
         """
-        width, height = self.get_image_info(image_path)
-
-        return {
-            "version": "2.4.4",
-            "flags": {},
-            "shapes": [],
-            "imagePath": os.path.basename(image_path),
-            "imageData": None,
-            "imageHeight": height,
-            "imageWidth": width
-        }
+        if image_size is None:
+            image_size = self.get_image_info(image_path)
+        width, height = image_size
+        return annotation_template(image_path, width, height)
 
     def bbox_to_points(self, bbox: List[float]) -> List[List[float]]:
         """将YOLO格式的bbox转换为4个点的坐标
@@ -155,199 +2357,1204 @@ class YOLOInference:
 
         return [x1, y1, x2, y2]
 
+    def shapes_to_bboxes(self, shapes: List[dict]) -> np.ndarray:
+        """批量将shapes的points转换为边界框数组，见 shapes_to_xyxy"""
+        return shapes_to_xyxy(shapes)
+
+    def shapes_to_detections(self, shapes: List[dict]) -> Detections:
+        """将标注文件中的shape转换为Detections，供训练标签导出
+
+        矩形、多边形和旋转框取外接矩形，点、线、圆等其他类型忽略；
+        不在标签列表中的标签类别索引为-1（导出时跳过），没有置信度的人工标注记为1。
+
+        Args:
+            shapes: 标注shape列表
+
+        Returns:
+            检测结果
+        """
+        shapes = [shape for shape in shapes if shape.get("shape_type", "rectangle")
+                  in ("rectangle", "polygon", "rotation")]
+        if not shapes:
+            return Detections.empty()
+        index = {label: i for i, label in enumerate(self.labels)}
+        return Detections(self.shapes_to_bboxes(shapes),
+                          [1.0 if shape.get("score") is None else shape["score"]
+                           for shape in shapes],
+                          [index.get(shape["label"], -1) for shape in shapes])
+
     def filter_duplicate_detections(self, new_shapes: List[dict],
                                   existing_shapes: List[dict],
-                                  iou_threshold: float = 0.85) -> List[dict]:
+                                  iou_threshold: float = 0.85,
+                                  self_nms: bool = False) -> List[dict]:
         """过滤重复的检测结果
 
+        按标签分组一次性计算新检测与现有标注之间的IOU矩阵，结果与逐对调用
+        calculate_iou 的结果完全一致。
+
         Args:
             new_shapes: 新的检测结果
             existing_shapes: 现有的标注
             iou_threshold: IOU阈值，大于此值认为是重复检测
+            self_nms: 是否同时在新检测之间做NMS（同标签、按置信度从高到低保留）
 
         Returns:
             过滤后的新检测结果列表
         """
-        filtered_shapes = []
+        if not new_shapes:
+            return []
+
+        new_bboxes = self.shapes_to_bboxes(new_shapes)
+        new_labels = np.array([shape["label"] for shape in new_shapes], dtype=object)
+        keep = np.ones(len(new_shapes), dtype=bool)
+
+        if existing_shapes:
+            existing_bboxes = self.shapes_to_bboxes(existing_shapes)
+            existing_labels = np.array([shape["label"] for shape in existing_shapes],
+                                       dtype=object)
+            duplicates = []
+            for label in dict.fromkeys(new_labels.tolist()):
+                existing_idx = np.flatnonzero(existing_labels == label)
+                if len(existing_idx) == 0:  # 只比较相同标签的标注
+                    continue
+                new_idx = np.flatnonzero(new_labels == label)
+                iou = box_iou_matrix(new_bboxes[new_idx], existing_bboxes[existing_idx])
+                is_duplicate = iou > iou_threshold
+                for row in np.flatnonzero(is_duplicate.any(axis=1)):
+                    # 与逐个比较时一样，报告第一个超过阈值的现有标注
+                    first_match = int(is_duplicate[row].argmax())
+                    duplicates.append((int(new_idx[row]), label, float(iou[row, first_match])))
+
+            for index, label, iou_value in sorted(duplicates, key=lambda d: d[0]):
+                keep[index] = False
+                self.log(f"Duplicate detection found for {label} "
+                         f"(IOU: {iou_value:.3f} > {iou_threshold}), skipping...")
+
+        if self_nms:
+            scores = np.array([shape.get("score") or 0.0 for shape in new_shapes],
+                              dtype=np.float64)
+            suppressed_count = 0
+            for label in dict.fromkeys(new_labels[keep].tolist()):
+                candidates = np.flatnonzero(keep & (new_labels == label))
+                if len(candidates) < 2:
+                    continue
+                kept = greedy_nms(new_bboxes[candidates], scores[candidates], iou_threshold)
+                keep[candidates] = False
+                keep[candidates[kept]] = True
+                suppressed_count += len(candidates) - len(kept)
+            if suppressed_count > 0:
+                self.log(f"Suppressed {suppressed_count} overlapping new detections "
+                         f"(IOU > {iou_threshold})")
+
+        return [shape for shape, kept in zip(new_shapes, keep) if kept]
+
+    def predict_image(self, image_path: str, conf_threshold: float = 0.25,
+                      return_results: bool = False):
+        """对单张图片进行推理
 
-        for new_shape in new_shapes:
-            is_duplicate = False
+        Args:
+            image_path: 图片路径
+            conf_threshold: 置信度阈值
+            return_results: 是否同时返回原始ultralytics结果（用于渲染结果图片）
 
-            # 将新检测的points转换为bbox
-            new_bbox = self.points_to_bbox(new_shape["points"])
-            new_label = new_shape["label"]
+        Returns:
+            推理结果列表，每个元素包含label和points；
+            return_results为True时返回 (shapes, results)
+        """
+        results = self.model(image_path, conf=conf_threshold)
 
-            # 检查与现有标注的IOU
-            for existing_shape in existing_shapes:
-                if existing_shape["label"] == new_label:  # 只比较相同标签的标注
-                    existing_bbox = self.points_to_bbox(existing_shape["points"])
-                    iou = self.calculate_iou(new_bbox, existing_bbox)
+        detections = Detections.concatenate([Detections.from_result(r) for r in results])
+        shapes = detections.to_shapes(self.labels)
 
-                    if iou > iou_threshold:
-                        print(f"Duplicate detection found for {new_label} "
-                              f"(IOU: {iou:.3f} > {iou_threshold}), skipping...")
-                        is_duplicate = True
-                        break
+        if return_results:
+            return shapes, results
+        return shapes
 
-            if not is_duplicate:
-                filtered_shapes.append(new_shape)
+    def _run_model(self, sources: list, conf_threshold: float) -> list:
+        """调用模型，并把预处理、前向计算和后处理的耗时记入计时器
 
-        return filtered_shapes
+        ultralytics 和 onnxruntime 后端的结果都带有每张图片的 speed（毫秒），
+        没有 speed 的结果把整个调用的耗时记为 forward。
+        """
+        if not self.timer.enabled:
+            return self.model(sources, conf=conf_threshold)
+
+        start = time.perf_counter()
+        results = self.model(sources, conf=conf_threshold)
+        elapsed = time.perf_counter() - start
+        speeds = [getattr(result, "speed", None) for result in results]
+        if speeds and all(speeds):
+            for stage, key in (("preprocess", "preprocess"), ("forward", "inference"),
+                               ("postprocess", "postprocess")):
+                total_ms = sum(speed.get(key) or 0.0 for speed in speeds)
+                self.timer.add(stage, total_ms / 1000.0, len(speeds))
+        else:
+            self.timer.add("forward", elapsed, len(results))
+        return results
+
+    def detect_batch(self, image_paths: List[str], conf_threshold: float = 0.25,
+                     images: Optional[List[np.ndarray]] = None):
+        """对多张图片进行批量推理，返回紧凑的数组形式检测结果
 
-    def predict_image(self, image_path: str, conf_threshold: float = 0.25) -> List[dict]:
-        """对单张图片进行推理
+        Args:
+            image_paths: 图片路径列表
+            conf_threshold: 置信度阈值
+            images: 已解码的BGR图片数组，与image_paths一一对应；为None时由模型自行读取
+
+        Returns:
+            (与image_paths一一对应的Detections列表, 原始ultralytics结果列表)
+        """
+        if not image_paths:
+            return [], []
+
+        if images is not None:
+            sources = list(images)
+        else:
+            # 压缩包中的图片只有内存数据，模型无法按路径读取
+            sources = [decode_image(path) if isinstance(path, ArchiveMember) else path
+                       for path in image_paths]
+        results = self._run_model(sources, conf_threshold)
+        if len(results) != len(image_paths):
+            raise RuntimeError(f"Expected {len(image_paths)} results, "
+                               f"got {len(results)}")
+
+        return [Detections.from_result(result) for result in results], list(results)
+
+    def detect_tiled(self, image: np.ndarray, conf_threshold: float = 0.25,
+                     tile_size: int = 640, tile_stride: int = 0,
+                     tile_nms_iou: float = 0.5) -> Detections:
+        """切片推理：将大图切分为重叠的切片，一次前向计算处理同一张图片的所有切片，
+        再把检测框映射回原图坐标，并用NMS合并切片接缝处的重复检测
 
         Args:
-            image_path: 图片路径
+            image: HxWx3 的 BGR 图片数组
             conf_threshold: 置信度阈值
+            tile_size: 切片大小（像素）
+            tile_stride: 切片步长，0表示 tile_size 的 80%（即20%重叠）
+            tile_nms_iou: 合并切片结果时NMS的IOU阈值
 
         Returns:
-            推理结果列表，每个元素包含label和points
+            原图坐标下的检测结果
         """
-        results = self.model(image_path, conf=conf_threshold)
+        if tile_stride <= 0:
+            tile_stride = max(1, int(tile_size * 0.8))
+        tiles, offsets = make_tiles(image, tile_size, tile_stride)
+        results = self._run_model(tiles, conf_threshold)
+
+        merged = []
+        for result, (offset_x, offset_y) in zip(results, offsets):
+            detections = Detections.from_result(result)
+            if len(detections):
+                detections.xyxy += np.array([offset_x, offset_y, offset_x, offset_y],
+                                            dtype=np.float32)
+                merged.append(detections)
+        return Detections.concatenate(merged).nms(tile_nms_iou)
+
+    def predict_batch(self, image_paths: List[str], conf_threshold: float = 0.25,
+                      return_results: bool = False,
+                      images: Optional[List[np.ndarray]] = None):
+        """对多张图片进行批量推理，一次前向计算处理整个列表
 
-        shapes = []
-        for result in results:
-            if result.boxes is not None:
-                for box in result.boxes:
-                    # 获取类别索引和置信度
-                    class_id = int(box.cls.item())
-                    confidence = float(box.conf.item())
-
-                    # 获取边界框坐标 [x1, y1, x2, y2]
-                    bbox = box.xyxy[0].tolist()
-
-                    # 获取标签名
-                    if 0 <= class_id < len(self.labels):
-                        label_name = self.labels[class_id]
-                    else:
-                        print(f"Warning: class_id {class_id} out of range, using 'unknown'")
-                        label_name = "unknown"
-
-                    # 转换为标注格式
-                    shape = {
-                        "label": label_name,
-                        "score": confidence,
-                        "points": self.bbox_to_points(bbox),
-                        "group_id": None,
-                        "description": "",
-                        "difficult": False,
-                        "shape_type": "rectangle",
-                        "flags": {},
-                        "attributes": {},
-                        "kie_linking": []
-                    }
-                    shapes.append(shape)
+        Args:
+            image_paths: 图片路径列表
+            conf_threshold: 置信度阈值
+            return_results: 是否同时返回原始ultralytics结果（用于渲染结果图片）
+            images: 已解码的BGR图片数组，与image_paths一一对应；为None时由模型自行读取
 
-        return shapes
+        Returns:
+            与image_paths一一对应的推理结果列表；
+            return_results为True时返回 (shapes列表, results列表)
+        """
+        batch_detections, results = self.detect_batch(image_paths, conf_threshold, images)
+        batch_shapes = [detections.to_shapes(self.labels) for detections in batch_detections]
+        if return_results:
+            return batch_shapes, results
+        return batch_shapes
+
+    def get_json_path(self, image_path: str, image_dir: Optional[str], output_dir: str) -> str:
+        """获取图片对应的标注文件路径
+
+        Args:
+            image_path: 图片路径
+            image_dir: 图片目录，图片来自文件列表或glob时为None
+            output_dir: 输出目录
+
+        Returns:
+            JSON标注文件路径
+        """
+        relative_path = os.path.relpath(image_path, image_dir) if image_dir else image_path
+        json_filename = Path(relative_path).stem + '.json'
+        return os.path.join(output_dir, json_filename)
+
+    def save_detections(self, image_path: str, image_dir: Optional[str], output_dir: str,
+                        new_shapes: Union[List[dict], Detections],
+                        iou_threshold: float = 0.85, self_nms: bool = False,
+                        image_size: Optional[Tuple[int, int]] = None) -> bool:
+        """将单张图片的检测结果追加/去重后写入标注文件
+
+        Args:
+            image_path: 图片路径
+            image_dir: 图片目录，图片来自文件列表或glob时为None
+            output_dir: 输出目录
+            new_shapes: 该图片的检测结果，可以是shape列表或Detections
+            iou_threshold: 重复检测的IOU阈值
+            self_nms: 是否同时在新检测之间做NMS
+            image_size: 已知的 (width, height)，为None时读取图片获取
+
+        Returns:
+            是否有检测结果
+        """
+        return self.update_annotation(image_path, image_dir, output_dir, new_shapes,
+                                      iou_threshold, self_nms, image_size)[0]
+
+    def update_annotation(self, image_path: str, image_dir: Optional[str], output_dir: str,
+                          new_shapes: Union[List[dict], Detections],
+                          iou_threshold: float = 0.85, self_nms: bool = False,
+                          image_size: Optional[Tuple[int, int]] = None
+                          ) -> Tuple[bool, List[dict]]:
+        """同 save_detections，同时返回标注文件中最终的全部shape
+
+        Returns:
+            (是否有检测结果, 已有标注加上去重后新检测的shape列表)
+        """
+        # 生成对应的JSON文件路径
+        json_path = self.get_json_path(image_path, image_dir, output_dir)
+
+        # 检查是否已存在标注文件
+        existing_shapes = []
+        if os.path.exists(json_path):
+            # 读取现有文件
+            with self.timer.stage("json_read"), open(json_path, 'r', encoding='utf-8') as f:
+                annotation_data = json.load(f)
+            existing_shapes = annotation_data.get("shapes", [])
+            self.log(f"Appending to existing annotation file: {json_path} "
+                     f"({len(existing_shapes)} existing annotations)")
+        else:
+            # 创建新文件
+            annotation_data = self.create_annotation_template(image_path, image_size)
+            self.log(f"Creating new annotation file: {json_path}")
+
+        if not len(new_shapes):
+            self.log("No detections found")
+            return False, annotation_data["shapes"]
+
+        if isinstance(new_shapes, Detections):
+            new_shapes = new_shapes.to_shapes(self.labels)
+
+        # 过滤重复检测
+        if existing_shapes or self_nms:
+            with self.timer.stage("dedupe"):
+                filtered_shapes = self.filter_duplicate_detections(
+                    new_shapes, existing_shapes, iou_threshold=iou_threshold,
+                    self_nms=self_nms)
+            added_count = len(filtered_shapes)
+            skipped_count = len(new_shapes) - added_count
+            if skipped_count > 0:
+                self.log(f"Filtered {skipped_count} duplicate detections, "
+                         f"adding {added_count} new detections")
+            elif not existing_shapes:
+                self.log(f"Added {added_count} detections")
+        else:
+            filtered_shapes = new_shapes
+            added_count = len(filtered_shapes)
+            self.log(f"Added {added_count} detections")
+
+        if filtered_shapes:  # 只有在有新检测时才保存
+            # 添加过滤后的新标注
+            annotation_data["shapes"].extend(filtered_shapes)
+
+            # 保存文件
+            with self.timer.stage("write"):
+                write_json_atomic(json_path, annotation_data)
+        else:
+            self.log("No new detections to add after filtering")
+
+        return True, annotation_data["shapes"]
+
+    def _iter_batches(self, image_paths: Iterable[str], batch_size: int,
+                      prefetch: int, decode_workers: int,
+                      loader: Optional[Callable[[str], object]] = None):
+        """将图片路径分组为批次，可选地在后台线程中预先解码
+
+        Args:
+            loader: 预取线程中读取单张图片的函数，为None时解码为BGR数组
+
+        Yields:
+            (批次图片路径列表, 批次解码数组列表或None)
+        """
+        if prefetch <= 0:
+            for batch_paths in batched(image_paths, batch_size):
+                yield batch_paths, None
+            return
+
+        # 队列深度至少容纳一个完整批次，才能与推理重叠
+        prefetcher = ImagePrefetcher(image_paths, num_workers=decode_workers,
+                                     queue_depth=max(prefetch, batch_size), timer=self.timer,
+                                     loader=loader or decode_image)
+        batch_paths, batch_images = [], []
+        for image_path, image, error in prefetcher:
+            if error is not None:
+                print(f"Error processing {image_path}: {str(error)}")
+                continue
+            batch_paths.append(image_path)
+            batch_images.append(image)
+            if len(batch_paths) == batch_size:
+                yield batch_paths, batch_images
+                batch_paths, batch_images = [], []
+        if batch_paths:
+            yield batch_paths, batch_images
+
+    def _iter_detections(self, image_paths: Iterable[str], conf_threshold: float,
+                         batch_size: int, prefetch: int, decode_workers: int,
+                         tile_options: Optional[dict] = None,
+                         loader: Optional[Callable[[str], object]] = None):
+        """在当前进程中逐批推理
+
+        Args:
+            tile_options: 传给 detect_tiled 的切片参数，为None时整图推理
+            loader: 预取线程中读取单张图片的函数，为None时解码为BGR数组
+
+        Yields:
+            (批次图片路径列表, Detections列表, 渲染用结果列表, 异常或None)
+        """
+        for batch_paths, batch_images in self._iter_batches(
+                image_paths, batch_size, prefetch, decode_workers, loader):
+            try:
+                if tile_options is None:
+                    batch_detections, batch_results = self.detect_batch(
+                        batch_paths, conf_threshold, images=batch_images)
+                else:
+                    batch_detections, batch_results = self._detect_tiled_batch(
+                        batch_paths, conf_threshold, batch_images, tile_options)
+            except Exception as e:
+                yield batch_paths, None, None, e
+                continue
+            yield batch_paths, batch_detections, batch_results, None
+
+    def _detect_tiled_batch(self, image_paths: List[str], conf_threshold: float,
+                            images: Optional[List[np.ndarray]], tile_options: dict):
+        """对一个批次中的每张图片分别做切片推理
+
+        Returns:
+            (Detections列表, AnnotatedImage列表)
+        """
+        if images is None:
+            images = []
+            for image_path in image_paths:
+                with self.timer.stage("decode"):
+                    images.append(decode_image(image_path))
+        batch_detections, batch_results = [], []
+        for image in images:
+            detections = self.detect_tiled(image, conf_threshold, **tile_options)
+            batch_detections.append(detections)
+            batch_results.append(AnnotatedImage(image, detections, self.labels))
+        return batch_detections, batch_results
+
+    def _iter_detections_multiprocess(self, image_paths: Iterable[str], conf_threshold: float,
+                                      batch_size: int, workers: int, threads_per_worker: int,
+                                      render_dir: Optional[str],
+                                      tile_options: Optional[dict] = None):
+        """在多个子进程中并行推理，每个子进程加载自己的模型
+
+        批次按提交顺序返回，因此后续的去重和写入与单进程运行完全一致。
+
+        Yields:
+            (批次图片路径列表, Detections列表, None, 异常或None)
+        """
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        print(f"Starting {workers} inference workers "
+              f"with {threads_per_worker} threads each")
+
+        # spawn 避免在已有线程和数据库连接的进程中 fork
+        context = multiprocessing.get_context("spawn")
+        max_inflight = workers * 2
+        task_queue = context.Queue(maxsize=max_inflight)
+        result_queue = context.Queue()
+        processes = [
+            context.Process(target=_inference_worker,
+                            args=(self.model_path, self.labels_file, self.backend, self.imgsz,
+                                  threads_per_worker, self.ensemble, self.fusion, self.fusion_iou,
+                                  conf_threshold, render_dir, tile_options,
+                                  task_queue, result_queue),
+                            daemon=True)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        batches = batched(image_paths, batch_size)
+        submitted = 0
+        next_index = 0
+        finished = {}
+        exhausted = False
+        try:
+            while True:
+                # 保持每个子进程都有待处理的批次，同时限制在途批次数量
+                while not exhausted and submitted - next_index - len(finished) < max_inflight:
+                    batch_paths = next(batches, None)
+                    if batch_paths is None:
+                        exhausted = True
+                        break
+                    task_queue.put((submitted, batch_paths))
+                    submitted += 1
+                if exhausted and next_index == submitted:
+                    break
+
+                index, batch_paths, batch_detections, error = \
+                    self._get_worker_result(result_queue, processes)
+                if index < 0:
+                    raise RuntimeError(error)
+                finished[index] = (batch_paths, batch_detections, error)
+
+                # 按提交顺序输出
+                while next_index in finished:
+                    batch_paths, batch_detections, error = finished.pop(next_index)
+                    next_index += 1
+                    yield (batch_paths, batch_detections, None,
+                           RuntimeError(error) if error is not None else None)
+        finally:
+            for _ in processes:
+                try:
+                    task_queue.put_nowait(None)
+                except queue.Full:
+                    break
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+    @staticmethod
+    def _get_worker_result(result_queue, processes):
+        """等待子进程返回结果，子进程异常退出时报错而不是一直阻塞"""
+        while True:
+            try:
+                return result_queue.get(timeout=1.0)
+            except queue.Empty:
+                dead = [p for p in processes if p.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"Inference worker exited unexpectedly "
+                                       f"(exit code {dead[0].exitcode})")
 
     def process_directory(self, image_dir: str, output_dir: Optional[str] = None,
-                         conf_threshold: float = 0.25, save_images: bool = False):
+                          *args, **kwargs):
         """处理目录中的所有图片
 
         Args:
             image_dir: 图片目录
             output_dir: 输出目录，如果为None则使用图片目录
-            conf_threshold: 置信度阈值
-            save_images: 是否保存推理结果图片
+            *args, **kwargs: 其余参数见 process_images
         """
         if output_dir is None:
             output_dir = image_dir
+        print(f"Scanning images in {image_dir}")
+        self.process_images(iter_image_files(image_dir), output_dir, *args,
+                            image_dir=image_dir, **kwargs)
 
-        # 确保输出目录存在
-        os.makedirs(output_dir, exist_ok=True)
+    def process_archive(self, archive_path: str, output_dir: str, *args, **kwargs):
+        """处理 zip/tar 压缩包中的所有图片，不解压到磁盘
 
-        # 支持的图片格式
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
+        成员按存储顺序顺序读取并在内存中解码，标注文件按成员路径命名。
 
-        # 遍历目录中的所有图片
-        image_paths = []
-        for root, dirs, files in os.walk(image_dir):
-            for file in files:
-                if Path(file).suffix.lower() in image_extensions:
-                    image_paths.append(os.path.join(root, file))
+        Args:
+            archive_path: 压缩包路径
+            output_dir: 输出目录
+            *args, **kwargs: 其余参数见 process_images
+        """
+        print(f"Reading images from archive {archive_path}")
+        self.process_images(iter_archive_images(archive_path), output_dir, *args,
+                            image_dir=archive_path, **kwargs)
+
+    def process_images(self, image_paths: Iterable[str], output_dir: str,
+                       conf_threshold: float = 0.25, save_images: bool = False,
+                       batch_size: int = 1, prefetch: int = 8,
+                       decode_workers: int = 2, write_workers: int = 2,
+                       iou_threshold: float = 0.85, self_nms: bool = False,
+                       use_cache: bool = False, force: bool = False,
+                       workers: int = 1, threads_per_worker: int = 0,
+                       tile_size: int = 0, tile_stride: int = 0,
+                       tile_nms_iou: float = 0.5, image_dir: Optional[str] = None,
+                       sink_path: Optional[str] = None,
+                       near_duplicate_distance: Optional[int] = None,
+                       yolo_dir: Optional[str] = None, coco_path: Optional[str] = None):
+        """处理一个图片路径序列
+
+        image_paths 可以是任意（惰性）可迭代对象，例如目录遍历、文件列表、标准输入或glob，
+        整个流水线按需消费，内存占用有上限。
 
-        print(f"Found {len(image_paths)} images to process")
+        Args:
+            image_paths: 图片路径序列
+            output_dir: 输出目录
+            conf_threshold: 置信度阈值
+            save_images: 是否保存推理结果图片
+            batch_size: 每次前向计算处理的图片数量
+            prefetch: 预取解码队列深度，0表示不预取，由模型逐批读取图片
+            decode_workers: 预取解码线程数
+            write_workers: 标注文件写入线程数，0表示在推理线程中同步写入
+            iou_threshold: 重复检测的IOU阈值
+            self_nms: 是否同时在新检测之间做NMS
+            use_cache: 是否使用输出目录中的检测结果缓存，支持中断后续跑；
+                开启时每张图片都要完整读取一次计算内容哈希
+            force: 忽略缓存中已有的结果，重新推理所有图片（新结果仍会写入缓存）
+            workers: 推理进程数，大于1时每个子进程加载独立的模型并行推理
+            threads_per_worker: 每个推理进程的PyTorch线程数，0表示按CPU核数平均分配
+            tile_size: 切片推理的切片大小，0表示整图推理
+            tile_stride: 切片步长，0表示 tile_size 的 80%
+            tile_nms_iou: 合并切片结果时NMS的IOU阈值
+            image_dir: 图片所在的根目录（仅用于计算相对路径），可以为None
+            sink_path: 汇总输出文件（.jsonl 或 .parquet），指定时所有检测结果写入这一个文件，
+                不再为每张图片生成标注文件，可用 expand_detections.py 展开
+            near_duplicate_distance: 感知哈希汉明距离不超过此值的图片视为近似重复，
+                直接复用已推理图片的检测结果（按尺寸缩放），为None时关闭
+            yolo_dir: 同时把检测结果直接写为YOLO txt训练标签的目录，为None时不输出
+            coco_path: 同时把检测结果直接写入的COCO instances JSON文件，为None时不输出
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be >= 1, got {batch_size}")
+        if self.tensor_cache is not None and (tile_size > 0 or workers > 1):
+            raise ValueError("The tensor cache cannot be used with tiling or multiple workers")
+
+        # 确保输出目录存在
+        os.makedirs(output_dir, exist_ok=True)
+        # 图片尺寸索引与检测结果缓存一样保存在输出目录中，不写入图片目录
+        image_header.set_index_path(os.path.join(output_dir, image_header.INDEX_FILENAME))
+
+        # 检测结果缓存：记录已完成的图片，中断后重新运行时跳过
+        # 切片推理的结果与整图推理不同，使用不同的缓存键
+        cache_model_key = self.model_hash
+        if self.backend != "ultralytics":
+            cache_model_key += f":{self.backend}/{self.imgsz}"
+        if tile_size > 0:
+            cache_model_key += f":tile{tile_size}/{tile_stride}/{tile_nms_iou}"
+        if self.ensemble:
+            # 集成结果取决于所有成员模型、它们的标签顺序和融合参数
+            members = [hash_file(self.labels_file)]
+            for member_path, member_labels_file in self.ensemble:
+                members += [hash_file(member_path), hash_file(member_labels_file)]
+            cache_model_key += f":ensemble/{self.fusion}/{self.fusion_iou}/" + \
+                hashlib.sha256(",".join(members).encode()).hexdigest()[:16]
+        cache = DetectionCache(os.path.join(output_dir, DetectionCache.FILENAME),
+                               cache_model_key) if use_cache else None
+        # 续跑时追加到中断前的汇总文件，否则重新写入，避免重复记录
+        sink = open_detection_sink(sink_path, append=cache is not None and not force) \
+            if sink_path else None
+        # 已完成的记录按输出位置区分；无法追加的汇总文件每次重写，不能跳过已完成的图片
+        if sink is None:
+            cache_output = "json"
+        elif sink.appendable:
+            cache_output = f"sink:{os.path.abspath(sink_path)}"
+        else:
+            cache_output = None
+        # 训练标签与标注文件一起输出，只有全部写出过的图片才算已完成
+        exporters = []
+        if yolo_dir is not None:
+            exporters.append(YoloTxtExporter(yolo_dir))
+        if coco_path is not None:
+            exporters.append(CocoExporter(coco_path, self.labels))
+        if cache_output is not None:
+            if yolo_dir is not None:
+                cache_output += f"+yolo:{os.path.abspath(yolo_dir)}"
+            if coco_path is not None:
+                cache_output += f"+coco:{os.path.abspath(coco_path)}"
+        image_hashes = {}
+        skipped_count = 0
+        replayed_count = 0
+        error_count = 0
+        near_duplicates = NearDuplicateIndex(near_duplicate_distance) \
+            if near_duplicate_distance is not None else None
+
+        def completion_target(image_path: str) -> str:
+            """已完成记录的输出目标：标注文件路径，或汇总记录中的图片名"""
+            if sink is None:
+                return os.path.abspath(self.get_json_path(image_path, image_dir, output_dir))
+            return os.path.relpath(image_path, image_dir) if image_dir else str(image_path)
+
+        def save_annotation(image_path: str, new_shapes, image_hash: Optional[str],
+                            image_size: Optional[Tuple[int, int]] = None) -> bool:
+            image = os.path.relpath(image_path, image_dir) if image_dir else image_path
+            if sink is not None and self_nms:
+                # 汇总记录没有已有标注，只在新检测之间按标签做NMS，与写标注文件时一致
+                kept = new_shapes.nms(iou_threshold)
+                if len(kept) < len(new_shapes):
+                    self.log(f"Suppressed {len(new_shapes) - len(kept)} overlapping new "
+                             f"detections (IOU > {iou_threshold})")
+                new_shapes = kept
+            # 训练标签与写出的结果一致：标注文件中合并、去重后的全部标注，或汇总记录本身
+            final_shapes = new_shapes
+            if sink is None:
+                has_detections, shapes = self.update_annotation(
+                    image_path, image_dir, output_dir, new_shapes, iou_threshold, self_nms,
+                    image_size=image_size)
+                if exporters:
+                    final_shapes = self.shapes_to_detections(shapes)
+            else:
+                if image_size is None:
+                    image_size = self.get_image_info(image_path)
+                with self.timer.stage("write"):
+                    sink.write(image, image_size, self.labels, new_shapes)
+                has_detections = len(new_shapes) > 0
+            if exporters:
+                if image_size is None:
+                    image_size = self.get_image_info(image_path)
+                with self.timer.stage("write"):
+                    for exporter in exporters:
+                        exporter.write(image, image_size, self.labels, final_shapes)
+            if cache is not None and image_hash is not None and cache_output is not None:
+                cache.mark_completed(completion_target(image_path), image_hash, conf_threshold,
+                                     cache_output, str(image_path))
+            return has_detections
+
+        # 结果图片在后台线程渲染，复用同一次推理的结果
+        renderer = ResultRenderer(timer=self.timer) if save_images else None
+        # 标注文件的读取、去重和写入在后台线程中进行；汇总文件只用一个线程按顺序写入
+        writer = AnnotationWriter(save_annotation, 1 if sink is not None else write_workers) \
+            if write_workers > 0 else None
 
         processed_count = 0
-        for image_path in image_paths:
+
+        def submit_annotation(image_path: str, new_shapes, image_hash: Optional[str],
+                              image_size: Optional[Tuple[int, int]] = None):
+            nonlocal processed_count
+            if writer is not None:
+                key = sink_path if sink is not None else \
+                    self.get_json_path(image_path, image_dir, output_dir)
+                writer.submit(key, image_path, new_shapes, image_hash, image_size)
+            elif save_annotation(image_path, new_shapes, image_hash, image_size):
+                processed_count += 1
+
+        image_count = 0
+
+        def submit_near_duplicates():
+            """写出参考图片结果已就绪的近似重复图片"""
+            nonlocal error_count
+            for image_path, reference, detections, image_size in near_duplicates.pop_ready():
+                if detections is None:
+                    print(f"Error processing {image_path}: "
+                          f"inference failed for near-duplicate {reference}")
+                    error_count += 1
+                    continue
+                self.log(f"Processing: {image_path} (near-duplicate of {reference})")
+                # 复用的结果不是真实推理结果，既不写入检测缓存也不标记为已完成，
+                # 之后关闭复用或收紧距离阈值的运行会重新判断这些图片
+                submit_annotation(image_path, detections, None, image_size)
+
+        def uncached_paths():
+            """跳过已完成的图片，直接复用已缓存的检测结果，只产出需要推理的图片"""
+            nonlocal skipped_count, replayed_count, image_count
+            for image_path in self.timer.iterate("discovery", image_paths):
+                image_count += 1
+                if cache is None:
+                    yield image_path
+                    continue
+                try:
+                    with self.timer.stage("cache"):
+                        image_hash = hash_file(image_path)
+                        completed = detections = None
+                        if not force:
+                            completed = cache_output is not None and cache.is_completed(
+                                completion_target(image_path), image_hash, conf_threshold,
+                                cache_output)
+                            if not completed:
+                                detections = cache.get_detections(image_hash, conf_threshold)
+                    if not force:
+                        if completed:
+                            skipped_count += 1
+                            if near_duplicates is not None:
+                                # 已完成的图片仍可作为本次新图片的参考
+                                add_reference(image_path,
+                                              cache.get_detections(image_hash, conf_threshold))
+                            continue
+                        if detections is not None:
+                            self.log(f"Processing: {image_path} (cached detections)")
+                            replayed_count += 1
+                            submit_annotation(image_path, detections, image_hash)
+                            if near_duplicates is not None:
+                                add_reference(image_path, detections)
+                            continue
+                except Exception as e:
+                    print(f"Error processing {image_path}: {str(e)}")
+                    continue
+                image_hashes[image_path] = image_hash
+                yield image_path
+
+        def add_reference(image_path: str, detections: Optional[Detections]):
+            """把已有检测结果的图片加入近似重复索引，没有缓存结果的忽略"""
+            if detections is None:
+                return
             try:
-                print(f"Processing: {image_path}")
-
-                # 生成对应的JSON文件路径
-                relative_path = os.path.relpath(image_path, image_dir)
-                json_filename = Path(relative_path).stem + '.json'
-                json_path = os.path.join(output_dir, json_filename)
-
-                # 检查是否已存在标注文件
-                existing_shapes = []
-                if os.path.exists(json_path):
-                    # 读取现有文件
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        annotation_data = json.load(f)
-                    existing_shapes = annotation_data.get("shapes", [])
-                    print(f"Appending to existing annotation file: {json_path} "
-                          f"({len(existing_shapes)} existing annotations)")
-                else:
-                    # 创建新文件
-                    annotation_data = self.create_annotation_template(image_path)
-                    print(f"Creating new annotation file: {json_path}")
-
-                # 进行推理
-                new_shapes = self.predict_image(image_path, conf_threshold)
-
-                if new_shapes:
-                    # 过滤重复检测
-                    if existing_shapes:
-                        filtered_shapes = self.filter_duplicate_detections(
-                            new_shapes, existing_shapes, iou_threshold=0.85)
-                        added_count = len(filtered_shapes)
-                        skipped_count = len(new_shapes) - added_count
-                        if skipped_count > 0:
-                            print(f"Filtered {skipped_count} duplicate detections, "
-                                  f"adding {added_count} new detections")
-                    else:
-                        filtered_shapes = new_shapes
-                        added_count = len(filtered_shapes)
-                        print(f"Added {added_count} detections")
+                with self.timer.stage("phash"):
+                    near_duplicates.add(image_path, detections)
+            except Exception as e:
+                print(f"Error hashing {image_path}: {str(e)}")
+
+        def unique_paths():
+            """近似重复的图片不送入推理，等参考图片的结果就绪后直接复用"""
+            for image_path in uncached_paths():
+                try:
+                    with self.timer.stage("phash"):
+                        duplicate = near_duplicates.add(image_path)
+                except Exception as e:
+                    print(f"Error processing {image_path}: {str(e)}")
+                    image_hashes.pop(image_path, None)
+                    continue
+                if duplicate:
+                    image_hashes.pop(image_path, None)
+                    submit_near_duplicates()
+                    continue
+                yield image_path
+
+        inference_paths = unique_paths() if near_duplicates is not None else uncached_paths()
+
+        tile_options = None
+        if tile_size > 0:
+            tile_options = {"tile_size": tile_size, "tile_stride": tile_stride,
+                            "tile_nms_iou": tile_nms_iou}
+
+        if workers > 1:
+            # 子进程自行渲染结果图片
+            batches = self._iter_detections_multiprocess(
+                inference_paths, conf_threshold, batch_size, workers,
+                threads_per_worker, output_dir if save_images else None, tile_options)
+        else:
+            # 有张量缓存时预取线程直接读取 letterbox 结果，复用缓存检查时计算的图片哈希
+            def load_cached(image_path: str):
+                return self.model.load(image_path, image_hashes.get(image_path))
+
+            loader = load_cached if self.tensor_cache is not None else None
+            batches = self._iter_detections(
+                inference_paths, conf_threshold, batch_size, prefetch, decode_workers,
+                tile_options, loader)
+
+        try:
+            for batch_paths, batch_shapes, batch_results, error in batches:
+                # 批量推理失败时整批记为错误
+                if error is not None:
+                    for image_path in batch_paths:
+                        image_hashes.pop(image_path, None)
+                        print(f"Error processing {image_path}: {str(error)}")
+                        if near_duplicates is not None:
+                            near_duplicates.set_detections(image_path, None)
+                    error_count += len(batch_paths)
+                    if near_duplicates is not None:
+                        submit_near_duplicates()
+                    continue
+
+                if batch_results is None:
+                    batch_results = [None] * len(batch_paths)
+
+                for image_path, new_shapes, result in zip(batch_paths, batch_shapes,
+                                                          batch_results):
+                    try:
+                        self.log(f"Processing: {image_path}")
+
+                        image_hash = image_hashes.pop(image_path, None)
+                        if cache is not None and image_hash is not None:
+                            cache.put_detections(image_hash, conf_threshold, new_shapes)
+                        if near_duplicates is not None:
+                            near_duplicates.set_detections(image_path, new_shapes)
+
+                        # 推理结果中已有原图尺寸，不必再读取图片
+                        image_size = None
+                        if result is not None and getattr(result, "orig_shape", None) is not None:
+                            image_size = (result.orig_shape[1], result.orig_shape[0])
+                        submit_annotation(image_path, new_shapes, image_hash, image_size)
+
+                        # 可选：保存推理结果图片
+                        if renderer is not None and result is not None:
+                            renderer.submit(result, os.path.join(
+                                output_dir, f"{Path(image_path).stem}_result.jpg"))
+
+                    except Exception as e:
+                        print(f"Error processing {image_path}: {str(e)}")
+                        error_count += 1
+                        continue
+
+                if near_duplicates is not None:
+                    submit_near_duplicates()
+                self.timer.maybe_emit(images=image_count)
+        finally:
+            if writer is not None:
+                write_errors = writer.close()
+                processed_count += writer.processed_count
+                if write_errors:
+                    print(f"Failed to write {len(write_errors)} annotation files:")
+                    for json_path, error in write_errors:
+                        print(f"  {json_path}: {error}")
+            if renderer is not None:
+                render_errors = renderer.close()
+                if render_errors:
+                    print(f"Failed to render {len(render_errors)} result images")
+            if sink is not None:
+                sink.close()
+                print(f"Detections written to {sink_path}")
+            for exporter in exporters:
+                exporter.close()
+            if yolo_dir is not None:
+                print(f"YOLO labels written to {yolo_dir}")
+            if coco_path is not None:
+                print(f"COCO annotations written to {coco_path}")
+            if cache is not None:
+                cache.close()
+            if self.tensor_cache is not None:
+                self.tensor_cache.flush()
+            image_header.save_index()
+
+        if error_count:
+            print(f"Failed to run inference on {error_count} images.")
+        if skipped_count or replayed_count:
+            print(f"Skipped {skipped_count} completed images, "
+                  f"reused cached detections for {replayed_count} images.")
+        near_duplicate_count = 0
+        if near_duplicates is not None:
+            near_duplicate_count = len(near_duplicates.decisions)
+            print(f"Reused detections for {near_duplicate_count} near-duplicate images "
+                  f"(max Hamming distance {near_duplicate_distance}):")
+            for image_path, reference, distance in near_duplicates.decisions:
+                print(f"  {image_path} <- {reference} (distance {distance})")
+            unresolved = near_duplicates.unresolved()
+            if unresolved:
+                print(f"{len(unresolved)} near-duplicate images were not written "
+                      f"because their reference images were not processed.")
+        if self.tensor_cache is not None:
+            print(f"Tensor cache: {self.tensor_cache.hits} hits, "
+                  f"{self.tensor_cache.misses} misses.")
+        print(f"Processing completed. Found {image_count} images, "
+              f"processed {processed_count} images.")
+        self.timer.emit(final=True, images=image_count, processed=processed_count,
+                        errors=error_count, skipped=skipped_count, replayed=replayed_count,
+                        near_duplicates=near_duplicate_count)
+
+    def sweep_confidence(self, image_paths: Iterable[str], output_dir: str,
+                         thresholds: List[float], sink_path: Optional[str] = None,
+                         iou_threshold: float = 0.85, **kwargs) -> dict:
+        """只推理一次，为多个置信度阈值分别生成输出
+
+        先以最低阈值推理，原始检测结果写入汇总文件（断点续跑同普通运行），
+        再读取汇总文件，按各阈值过滤后分别输出。类内NMS按置信度从高到低进行，
+        因此过滤结果与直接用该阈值推理一致。续跑时汇总文件中同一张图片可能有多条记录
+        （例如之前以不同的最低阈值运行过），只使用最后写入的一条。
 
-                    if filtered_shapes:  # 只有在有新检测时才保存
-                        # 添加过滤后的新标注
-                        annotation_data["shapes"].extend(filtered_shapes)
+        Args:
+            image_paths: 图片路径序列
+            output_dir: 输出目录，未指定 sink_path 时每个阈值输出到子目录 conf_<阈值>/
+            thresholds: 置信度阈值列表
+            sink_path: 原始检测结果的汇总文件，指定时每个阈值输出同格式的
+                <文件名>.conf_<阈值><扩展名>，为None时原始结果写入 output_dir/sweep_detections.jsonl
+            iou_threshold: 与已有标注合并时重复检测的IOU阈值
+            **kwargs: 其余参数见 process_images
 
-                        # 保存文件
-                        with open(json_path, 'w', encoding='utf-8') as f:
-                            json.dump(annotation_data, f, indent=2, ensure_ascii=False)
+        Returns:
+            {阈值: {"images": 图片数, "images_with_detections": 有检测的图片数,
+                    "detections": 检测数, "labels": {标签: 检测数}}}
+        """
+        thresholds = sorted(set(thresholds))
+        if not thresholds:
+            raise ValueError("At least one confidence threshold is required")
+        os.makedirs(output_dir, exist_ok=True)
+        raw_path = sink_path or os.path.join(output_dir, "sweep_detections.jsonl")
+        print(f"Sweeping {len(thresholds)} confidence thresholds, "
+              f"running inference once at {thresholds[0]:g}")
+        self.process_images(image_paths, output_dir, conf_threshold=thresholds[0],
+                            iou_threshold=iou_threshold, sink_path=raw_path, **kwargs)
+
+        outputs = {}
+        for threshold in thresholds:
+            if sink_path is None:
+                outputs[threshold] = os.path.join(output_dir, f"conf_{threshold:g}")
+                os.makedirs(outputs[threshold], exist_ok=True)
+            else:
+                stem, extension = os.path.splitext(sink_path)
+                path = f"{stem}.conf_{threshold:g}{extension}"
+                # 各阈值的汇总文件由原始结果完整生成，每次重新写入
+                if os.path.exists(path):
+                    os.remove(path)
+                outputs[threshold] = open_detection_sink(path)
+
+        # 同一张图片只取最后一条记录，避免续跑时追加的旧记录被重复统计
+        last_records = {}
+        for index, record in enumerate(iter_sink_records(raw_path)):
+            last_records[record["image"]] = index
+
+        summary = {threshold: {"images": 0, "images_with_detections": 0, "detections": 0,
+                               "labels": {}} for threshold in thresholds}
+        try:
+            for index, record in enumerate(iter_sink_records(raw_path)):
+                if last_records[record["image"]] != index:
+                    continue
+                for threshold in thresholds:
+                    filtered = filter_sink_record(record, threshold)
+                    counts = summary[threshold]
+                    counts["images"] += 1
+                    counts["images_with_detections"] += bool(filtered["score"])
+                    counts["detections"] += len(filtered["score"])
+                    for label in filtered["label"]:
+                        counts["labels"][label] = counts["labels"].get(label, 0) + 1
+                    if sink_path is None:
+                        merge_sink_record(filtered, outputs[threshold], iou_threshold)
                     else:
-                        print("No new detections to add after filtering")
+                        detections = Detections(filtered["xyxy"], filtered["score"],
+                                                np.arange(len(filtered["label"])))
+                        outputs[threshold].write(filtered["image"],
+                                                 (filtered["width"], filtered["height"]),
+                                                 filtered["label"], detections)
+        finally:
+            if sink_path is not None:
+                for sink in outputs.values():
+                    sink.close()
+
+        print("Confidence sweep:")
+        for threshold in thresholds:
+            counts = summary[threshold]
+            labels = ", ".join(f"{label}: {count}"
+                               for label, count in sorted(counts["labels"].items()))
+            target = outputs[threshold] if sink_path is None else outputs[threshold].path
+            print(f"  conf > {threshold:g}: {counts['detections']} detections in "
+                  f"{counts['images_with_detections']}/{counts['images']} images "
+                  f"({labels or 'none'}) -> {target}")
+        write_json_atomic(os.path.join(output_dir, "sweep_summary.json"),
+                          {f"{threshold:g}": counts for threshold, counts in summary.items()})
+        return summary
+
+    def process_video(self, video_path: str, output_dir: str,
+                      conf_threshold: float = 0.25, batch_size: int = 1,
+                      frame_stride: int = 1, motion_threshold: float = 2.0,
+                      save_frames: bool = False, write_workers: int = 2,
+                      iou_threshold: float = 0.85, self_nms: bool = False):
+        """对视频逐帧推理，画面几乎不变的帧直接复用上一次推理的检测结果
+
+        每个输出帧生成一个 <视频名>_<帧序号>.json 标注文件（X-AnyLabeling格式）。
+        运动检测用低分辨率灰度缩略图与上一次推理帧的平均绝对差，低于阈值时不推理。
 
-                    processed_count += 1
-                else:
-                    print("No detections found")
+        Args:
+            video_path: 视频文件路径
+            output_dir: 输出目录
+            conf_threshold: 置信度阈值
+            batch_size: 每次前向计算处理的帧数
+            frame_stride: 帧间隔，1表示每一帧都输出
+            motion_threshold: 缩略图平均绝对差（0-255）低于此值时复用上一次的检测结果，
+                0表示每帧都推理
+            save_frames: 是否同时保存帧图片，供标注工具打开
+            write_workers: 标注文件写入线程数，0表示同步写入
+            iou_threshold: 重复检测的IOU阈值
+            self_nms: 是否同时在新检测之间做NMS
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be >= 1, got {batch_size}")
+        if frame_stride < 1:
+            raise ValueError(f"frame_stride must be >= 1, got {frame_stride}")
 
-                # 可选：保存推理结果图片
-                if save_images:
-                    results = self.model(image_path, conf=conf_threshold)
-                    for result in results:
-                        result.save(filename=os.path.join(output_dir, f"{Path(image_path).stem}_result.jpg"))
+        os.makedirs(output_dir, exist_ok=True)
+        video_stem = Path(video_path).stem
 
-            except Exception as e:
-                print(f"Error processing {image_path}: {str(e)}")
-                continue
+        def save_frame_annotation(frame_path: str, frame: Optional[np.ndarray],
+                                  detections: Detections, image_size: Tuple[int, int]) -> bool:
+            if frame is not None:
+                Image.fromarray(np.ascontiguousarray(frame[:, :, ::-1])).save(frame_path)
+            return self.save_detections(frame_path, None, output_dir, detections,
+                                        iou_threshold, self_nms, image_size=image_size)
 
-        print(f"Processing completed. Processed {processed_count} images.")
+        writer = AnnotationWriter(save_frame_annotation, write_workers) \
+            if write_workers > 0 else None
+
+        processed_count = 0
+        frame_count = 0
+        inferred_count = 0
+        last_detections = None
+        last_thumbnail = None
+        # 待输出的帧：(帧序号, 帧数组或None, 待推理批次中的下标或None, 图片尺寸)
+        pending = []
+        batch_frames = []
+
+        def flush():
+            nonlocal processed_count, inferred_count, last_detections
+            if batch_frames:
+                results = self._run_model(list(batch_frames), conf_threshold)
+                batch_detections = [Detections.from_result(result) for result in results]
+                inferred_count += len(batch_frames)
+            for frame_index, frame, batch_index, image_size in pending:
+                if batch_index is not None:
+                    last_detections = batch_detections[batch_index]
+                frame_path = os.path.join(output_dir, f"{video_stem}_{frame_index:06d}.jpg")
+                self.log(f"Processing: {video_path} frame {frame_index}"
+                         + ("" if batch_index is not None else " (reused detections)"))
+                args = (frame_path, frame if save_frames else None,
+                        last_detections, image_size)
+                if writer is not None:
+                    writer.submit(frame_path, *args)
+                elif save_frame_annotation(*args):
+                    processed_count += 1
+            pending.clear()
+            batch_frames.clear()
+
+        try:
+            for frame_index, frame in iter_video_frames(video_path, frame_stride):
+                frame_count += 1
+                image_size = (frame.shape[1], frame.shape[0])
+
+                run_model = last_thumbnail is None or motion_threshold <= 0
+                thumbnail = None
+                if not run_model:
+                    thumbnail = motion_thumbnail(frame)
+                    run_model = float(np.abs(thumbnail - last_thumbnail).mean()) >= motion_threshold
+                if run_model:
+                    last_thumbnail = thumbnail if thumbnail is not None else motion_thumbnail(frame)
+                    pending.append((frame_index, frame, len(batch_frames), image_size))
+                    batch_frames.append(frame)
+                else:
+                    pending.append((frame_index, frame if save_frames else None, None, image_size))
+
+                # 复用结果的帧不占用推理批次，但要限制缓存的帧数
+                if len(batch_frames) >= batch_size or len(pending) >= batch_size * 16:
+                    flush()
+                    self.timer.maybe_emit(images=frame_count)
+            flush()
+        finally:
+            if writer is not None:
+                write_errors = writer.close()
+                processed_count += writer.processed_count
+                if write_errors:
+                    print(f"Failed to write {len(write_errors)} annotation files:")
+                    for json_path, error in write_errors:
+                        print(f"  {json_path}: {error}")
+
+        print(f"Processing completed. {frame_count} frames, ran inference on "
+              f"{inferred_count} frames, reused detections for "
+              f"{frame_count - inferred_count} frames, {processed_count} frames with detections.")
+        self.timer.emit(final=True, images=frame_count, inferred=inferred_count,
+                        processed=processed_count)
+
+
+def _inference_worker(model_path: str, labels_file: str, backend: str, imgsz: int,
+                      num_threads: int, ensemble: List[Tuple[str, str]], fusion: str,
+                      fusion_iou: float,
+                      conf_threshold: float, render_dir: Optional[str],
+                      tile_options: Optional[dict], task_queue, result_queue):
+    """推理子进程：加载独立的模型，从任务队列中取批次推理，将检测结果发回主进程
+
+    任务为 (批次序号, 图片路径列表)，None 表示退出。
+    结果为 (批次序号, 图片路径列表, Detections列表或None, 错误信息或None)，
+    批次序号为 -1 表示模型加载失败。
+    """
+    try:
+        try:
+            import torch
+            torch.set_num_threads(num_threads)
+        except ImportError:
+            pass
+        inference = YOLOInference(model_path, labels_file, backend, imgsz, num_threads,
+                                  ensemble=ensemble, fusion=fusion, fusion_iou=fusion_iou)
+    except Exception as e:
+        result_queue.put((-1, None, None, f"Failed to load model: {str(e)}"))
+        return
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        index, batch_paths = task
+        try:
+            if tile_options is None:
+                batch_detections, batch_results = inference.detect_batch(
+                    batch_paths, conf_threshold)
+            else:
+                batch_detections, batch_results = inference._detect_tiled_batch(
+                    batch_paths, conf_threshold, None, tile_options)
+            if render_dir is not None:
+                for image_path, result in zip(batch_paths, batch_results):
+                    try:
+                        result.save(filename=os.path.join(
+                            render_dir, f"{Path(image_path).stem}_result.jpg"))
+                    except Exception as e:
+                        print(f"Error rendering {image_path}: {str(e)}")
+            result_queue.put((index, batch_paths, batch_detections, None))
+        except Exception as e:
+            result_queue.put((index, batch_paths, None, str(e)))
 
 
 def main():
     parser = argparse.ArgumentParser(description="YOLOv8模型推理脚本")
     parser.add_argument("model_path", help="YOLO模型文件路径 (.pt)")
     parser.add_argument("labels_file", help="标签文件路径 (labels.txt)")
-    parser.add_argument("image_dir", help="图片目录路径")
+    parser.add_argument("image_dir", nargs="?",
+                       help="图片目录路径，也可以是 .zip/.tar(.gz) 压缩包（使用 --file_list 或 --glob 时可省略）")
     parser.add_argument("--output_dir", "-o", help="输出目录路径 (默认为图片目录)")
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument("--file_list", metavar="FILE",
+                              help="从文本文件逐行读取图片路径，\"-\" 表示从标准输入读取")
+    source_group.add_argument("--glob", nargs="+", metavar="PATTERN",
+                              help="按glob模式匹配图片，支持 ** 递归")
+    source_group.add_argument("--video", metavar="FILE",
+                              help="对视频文件逐帧推理，每个输出帧生成一个标注文件")
     parser.add_argument("--conf", "-c", type=float, default=0.25,
                        help="置信度阈值 (默认: 0.25)")
+    parser.add_argument("--backend", choices=["ultralytics", "onnxruntime"],
+                       default="ultralytics",
+                       help="推理后端，onnxruntime 会导出并缓存ONNX模型在CPU上推理 (默认: ultralytics)")
+    parser.add_argument("--imgsz", type=int, default=640,
+                       help="onnxruntime 后端的输入尺寸 (默认: 640)")
     parser.add_argument("--save_images", "-s", action="store_true",
                        help="保存推理结果图片")
+    parser.add_argument("--batch_size", "-b", type=int, default=1,
+                       help="每次前向计算处理的图片数量 (默认: 1)")
+    parser.add_argument("--prefetch", type=int, default=8,
+                       help="预取解码队列深度，0表示关闭预取 (默认: 8)")
+    parser.add_argument("--decode_workers", type=int, default=2,
+                       help="预取解码线程数 (默认: 2)")
+    parser.add_argument("--write_workers", type=int, default=2,
+                       help="标注文件写入线程数，0表示同步写入 (默认: 2)")
+    parser.add_argument("--iou_threshold", type=float, default=0.85,
+                       help="重复检测的IOU阈值 (默认: 0.85)")
+    parser.add_argument("--self_nms", action="store_true",
+                       help="同时在新检测结果之间做NMS去重")
+    parser.add_argument("--resume", "-r", action="store_true",
+                       help="使用输出目录中的检测结果缓存，跳过已完成的图片（需要完整读取每张图片计算哈希）")
+    parser.add_argument("--force", "-f", action="store_true",
+                       help="与 --resume 一起使用：忽略缓存，重新推理所有图片")
+    parser.add_argument("--workers", "-w", type=int, default=1,
+                       help="推理进程数，每个进程加载独立的模型 (默认: 1)")
+    parser.add_argument("--threads_per_worker", type=int, default=0,
+                       help="每个推理进程的PyTorch线程数，0表示按CPU核数平均分配 (默认: 0)")
+    parser.add_argument("--tile_size", type=int, default=0,
+                       help="切片推理的切片大小（像素），0表示整图推理 (默认: 0)")
+    parser.add_argument("--tile_stride", type=int, default=0,
+                       help="切片步长，0表示切片大小的80%% (默认: 0)")
+    parser.add_argument("--tile_nms_iou", type=float, default=0.5,
+                       help="合并切片接缝处检测结果的NMS IOU阈值 (默认: 0.5)")
+    parser.add_argument("--frame_stride", type=int, default=1,
+                       help="视频模式下的帧间隔 (默认: 1)")
+    parser.add_argument("--motion_threshold", type=float, default=2.0,
+                       help="视频模式下缩略图平均灰度差低于此值时复用上一帧的检测结果，0表示每帧都推理 (默认: 2.0)")
+    parser.add_argument("--save_frames", action="store_true",
+                       help="视频模式下同时保存帧图片")
+    parser.add_argument("--quiet", "-q", action="store_true",
+                       help="不打印逐图片的处理信息，只输出错误和汇总")
+    parser.add_argument("--timing", metavar="FILE",
+                       help="按阶段统计耗时，并把JSON报告写入此文件，\"-\" 表示输出到标准错误")
+    parser.add_argument("--timing_interval", type=float, default=30.0,
+                       help="运行过程中输出耗时报告的间隔秒数，0表示只在结束时输出 (默认: 30)")
+    parser.add_argument("--sink", metavar="FILE",
+                       help="将所有检测结果写入一个 .jsonl 或 .parquet 汇总文件，而不是每张图片一个标注文件")
+    parser.add_argument("--yolo_dir", metavar="DIR",
+                       help="同时把检测结果直接写为YOLO txt训练标签（类别顺序同标签文件）")
+    parser.add_argument("--coco", metavar="FILE",
+                       help="同时把检测结果直接写入一个COCO instances JSON文件（类别顺序同标签文件）")
+    parser.add_argument("--sweep", type=float, nargs="+", metavar="CONF",
+                       help="只推理一次，为多个置信度阈值分别输出结果和检测数量统计（忽略 --conf）")
+    parser.add_argument("--near_duplicates", type=int, metavar="DISTANCE",
+                       help="感知哈希（64位dHash）汉明距离不超过此值的图片视为近似重复，"
+                            "直接复用已推理图片的检测结果，不再推理（建议 4 左右）")
+    parser.add_argument("--tensor_cache", metavar="DIR",
+                       help="把 letterbox 后的图片张量缓存到此目录的内存映射文件中，"
+                            "之后的运行直接读取，跳过解码（仅 onnxruntime 后端）")
+    parser.add_argument("--tensor_cache_gb", type=float, default=10.0,
+                       help="张量缓存的大小上限（GB），超出时淘汰最久未使用的图片 (默认: 10)")
+    parser.add_argument("--ensemble", nargs=2, action="append", metavar=("MODEL", "LABELS"),
+                       help="与主模型集成推理的其他模型及其标签文件，可重复指定；"
+                            "图片只解码一次，各模型结果按标签名对齐后融合")
+    parser.add_argument("--fusion", choices=["wbf", "nms"], default="wbf",
+                       help="集成结果的融合方式：加权框融合或NMS (默认: wbf)")
+    parser.add_argument("--fusion_iou", type=float, default=0.55,
+                       help="集成结果融合的IOU阈值 (默认: 0.55)")
 
     args = parser.parse_args()
 
@@ -360,19 +3567,112 @@ def main():
         print(f"标签文件不存在: {args.labels_file}")
         return 1
 
-    if not os.path.exists(args.image_dir):
-        print(f"图片目录不存在: {args.image_dir}")
-        return 1
+    for member_path, member_labels_file in args.ensemble or []:
+        if not os.path.exists(member_path):
+            print(f"模型文件不存在: {member_path}")
+            return 1
+        if not os.path.exists(member_labels_file):
+            print(f"标签文件不存在: {member_labels_file}")
+            return 1
+
+    if args.sink is not None and args.video is not None:
+        parser.error("--sink 不能与 --video 同时使用")
+    if args.sweep is not None and args.video is not None:
+        parser.error("--sweep 不能与 --video 同时使用")
+    if (args.yolo_dir is not None or args.coco is not None) and \
+            (args.video is not None or args.sweep is not None):
+        parser.error("--yolo_dir 和 --coco 不能与 --video 或 --sweep 同时使用")
+    if args.tensor_cache is not None:
+        if args.backend != "onnxruntime":
+            parser.error("--tensor_cache 需要 --backend onnxruntime")
+        if args.ensemble or args.video is not None or args.tile_size > 0 or args.workers > 1:
+            parser.error("--tensor_cache 不能与 --ensemble、--video、--tile_size 或 --workers 同时使用")
+    if args.near_duplicates is not None and args.video is not None:
+        parser.error("--near_duplicates 不能与 --video 同时使用（视频模式使用 --motion_threshold）")
+
+    if args.file_list is None and args.glob is None and args.video is None:
+        if args.image_dir is None:
+            parser.error("需要指定 image_dir、--file_list、--glob 或 --video 之一")
+        if not os.path.exists(args.image_dir):
+            print(f"图片目录不存在: {args.image_dir}")
+            return 1
+        if is_archive_file(args.image_dir) and args.output_dir is None:
+            parser.error("从压缩包读取图片时必须指定 --output_dir")
+    else:
+        if args.image_dir is not None:
+            parser.error("image_dir 不能与 --file_list、--glob 或 --video 同时使用")
+        if args.output_dir is None:
+            parser.error("使用 --file_list、--glob 或 --video 时必须指定 --output_dir")
+        if args.file_list not in (None, "-") and not os.path.exists(args.file_list):
+            print(f"图片列表文件不存在: {args.file_list}")
+            return 1
+        if args.video is not None and not os.path.exists(args.video):
+            print(f"视频文件不存在: {args.video}")
+            return 1
 
     # 创建推理器并处理
     try:
-        inference = YOLOInference(args.model_path, args.labels_file)
-        inference.process_directory(
-            args.image_dir,
-            args.output_dir,
-            args.conf,
-            args.save_images
+        timer = StageTimer(args.timing, args.timing_interval) if args.timing else None
+        inference = YOLOInference(args.model_path, args.labels_file,
+                                  backend=args.backend, imgsz=args.imgsz,
+                                  quiet=args.quiet, timer=timer, ensemble=args.ensemble,
+                                  fusion=args.fusion, fusion_iou=args.fusion_iou,
+                                  tensor_cache=args.tensor_cache,
+                                  tensor_cache_size=int(args.tensor_cache_gb * 1024 ** 3))
+        options = dict(
+            conf_threshold=args.conf,
+            save_images=args.save_images,
+            batch_size=args.batch_size,
+            prefetch=args.prefetch,
+            decode_workers=args.decode_workers,
+            write_workers=args.write_workers,
+            iou_threshold=args.iou_threshold,
+            self_nms=args.self_nms,
+            use_cache=args.resume,
+            force=args.force,
+            workers=args.workers,
+            threads_per_worker=args.threads_per_worker,
+            tile_size=args.tile_size,
+            tile_stride=args.tile_stride,
+            tile_nms_iou=args.tile_nms_iou,
+            sink_path=args.sink,
+            near_duplicate_distance=args.near_duplicates,
+            yolo_dir=args.yolo_dir,
+            coco_path=args.coco
         )
+        if args.video is not None:
+            inference.process_video(
+                args.video,
+                args.output_dir,
+                conf_threshold=args.conf,
+                batch_size=args.batch_size,
+                frame_stride=args.frame_stride,
+                motion_threshold=args.motion_threshold,
+                save_frames=args.save_frames,
+                write_workers=args.write_workers,
+                iou_threshold=args.iou_threshold,
+                self_nms=args.self_nms
+            )
+        elif args.sweep is not None:
+            del options["conf_threshold"]
+            if args.file_list is not None:
+                image_paths = iter_file_list(args.file_list)
+            elif args.glob is not None:
+                image_paths = iter_glob(args.glob)
+            else:
+                image_paths = iter_archive_images(args.image_dir) \
+                    if is_archive_file(args.image_dir) else iter_image_files(args.image_dir)
+                options["image_dir"] = args.image_dir
+            inference.sweep_confidence(image_paths, args.output_dir or args.image_dir,
+                                       args.sweep, **options)
+        elif args.file_list is not None:
+            inference.process_images(iter_file_list(args.file_list), args.output_dir, **options)
+        elif args.glob is not None:
+            inference.process_images(iter_glob(args.glob), args.output_dir, **options)
+        elif is_archive_file(args.image_dir):
+            inference.process_archive(args.image_dir, args.output_dir, **options)
+        else:
+            inference.process_directory(args.image_dir, args.output_dir, **options)
     except Exception as e:
         print(f"处理过程中出错: {str(e)}")
         return 1